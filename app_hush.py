@@ -1,10 +1,5 @@
-import json, os, sys, re, time, datetime, random
-from websockets.sync.client import connect
-from bzz import Bzz
-
-
-# All triggers will be scaled by this amount. e.g. to half all triggers, set this to 0.5 or 1/2
-scaler = 1
+import os, sys, time, datetime, random
+from bzz import Bzz, TriggerStore, OutputGroup
 
 ##################################################################
 # We need to provide two methods. The first, Parse, takes
@@ -14,51 +9,64 @@ scaler = 1
 # If we're skipping, return False instead.
 # This method is passed the status_dict of the current post
 # and the config object for the instance.
+#
+# Passing None uses Bzz's built-in parser, driven by the `rules`
+# in the config. By default it looks for 'bz' to 'bzzzzzzzzzz' and
+# pushes [intensity, source account, created datetime], with 10
+# intensity per z, honouring the allow and deny lists.
 ##################################################################
 
-def parse(item, config):
-  """ Checks if a post matches a regex. If so, calculates
-      intensity based on the length of the match and pushes:
-      [intensity, source account, created datetime]
-      If disallowed by allow or deny list, returns False
-  """
-
-  post = item['content']
-
-  matches = re.search('[bB][z]{1,10}', post)
-
-  if matches:
-    count = len(matches.group(0))-1
-    intensity = count * 10
-    acct = item['account']['acct']
-    if config.deny_list is not None and acct.lower() in config.deny_list:
-       print(f'Skipping {intensity} from {acct}, sent {item["created_at"].isoformat()} [denylist]')
-    elif config.allow_list is not None and acct.lower() not in config.allow_list:
-       print(f'Skipping {intensity} from {acct}, sent {item["created_at"].isoformat()} [allowlist]')
-    else:
-       print(f'Pushing {intensity} from {acct}, sent {item["created_at"].isoformat()}')
-       return([intensity, acct, item['created_at']])
-  return False
+parse = None
 
 ##################################################################
 # The second is what to actually do with what Parse produces.
 ##################################################################
 
-# We realistically need  to do actual setup on this before it's easily usable. For now
-# we just assume that intiface knows about our toy and it's the only one being reported
-# so we know it's deviceindex 0.
-
 # Intiface is running on my local machine; I'm SSHing to my remote server where Bzz is
 # running, and using an SSH tunnel to forward requests on that end to port 12345 to my
 # local port 12345 where Intiface can see it.
 
-ws = connect("ws://localhost:12345")
-ws.send(json.dumps([{"RequestServerInfo":{"Id":1,"ClientName":"Bzz","MessageVersion":3}}]))
+# The client keeps the connection up in the background, reconnecting if the tunnel drops,
+# and asks Intiface which devices it knows about. By default we drive the first one it reports.
+
+# It's only started the first time we act, so commands that never act (closepost, replay...)
+# don't need websockets installed or Intiface running.
+
+plug = None
+
+def buttplug():
+  global plug
+  if plug is None:
+    from bzz.buttplug import ButtplugClient
+    plug = ButtplugClient("ws://localhost:12345").start()
+    plug.wait_ready(5)
+  return plug
 
 last_intensity = 0 # The last intensity value set; used internally
 secs = 10 # How long a given intensity will last
 end_time = datetime.datetime.now() # Precomputed end of the current secs-length window
 
+def vibrate(device_index=None):
+  """ An output that sets one device (or the first one connected) to each trigger's
+      intensity, and waits for Intiface to confirm it
+  """
+  def send(item, target_id, config):
+    client = buttplug()
+    device = client.default_device() if device_index is None else device_index
+    if device is None:
+      print('No devices connected')
+      return False
+
+    intensity = item[0]
+    reply = client.stop(device) if intensity == 0 else client.scalar(device, intensity/100)
+    reply.result(5)
+  return send
+
+# Each trigger goes to every device in the group at once, scaled per device. e.g. to halve
+# all triggers, add with scale=0.5, or set "output_scales": {"hush": 0.5} in the config.
+# To drive more toys, add them by Intiface DeviceIndex, e.g. .add('lush', vibrate(1))
+outputs = OutputGroup(timeout=10).add('hush', vibrate(), scale=1)
+
 def act(item, target_id, config):
   """ Acts on the output from Parse.
       Sets an intensity and holds there for a configurable about of time
@@ -71,32 +79,23 @@ def act(item, target_id, config):
   if now < end_time:
     return False
 
-  end_time = now + datetime.timedelta(0, secs)
-
   intensity, user, sent = item
 
-  if user is not None:
-    with open(config.logfilepath, 'a+') as logfile:
-      logfile.write(f'{target_id},{sent.isoformat()},{datetime.datetime.now().isoformat()},{intensity},{user}\n')
-
   print(f'Setting {intensity} ({intensity/100}) on behalf of {user if user is not None else "host"}')
 
+  results = outputs(item, target_id, config)
+  if results == False:
+    return False
+
+  for name, ok in results.items():
+    if not ok:
+      print(f'Device error: {name}')
+
+  end_time = now + datetime.timedelta(0, secs)
   last_intensity = intensity
 
-  if scaler != 1:
-    intensity = (intensity/100) * scaler
-    print(f'Scaled trigger: {intensity * 100}')
-
-  if intensity == 0:
-    ws.send(json.dumps([{"StopDeviceCmd":{"Id":5,"DeviceIndex":0}}]))
-    print(ws.recv())
-  else:
-    ws.send(json.dumps(([{"ScalarCmd":{
-      "Id":4,
-      "DeviceIndex":0,
-      "Scalars":[{"Index":0,"Scalar":intensity/100,"ActuatorType":"Vibrate"}]
-    }}])))
-    print(ws.recv())
+  if user is not None:
+    TriggerStore.from_config(config).record(target_id, intensity, user, sent=sent)
 
 ##################################################################
 # New feature - we can pass an 'empty' function that receives the queue if empty
@@ -115,8 +114,6 @@ def empty(queue):
 # Start monitoring. Pass our two methods to the harness, along with our saved last_action_id if we have one.
 ##################################################################
 
-print(f'Scaler is {scaler}')
-
 bzz = Bzz(parse, act, config_file='config-hush.json', empty_function=empty)
 
 arg = sys.argv[1] if len(sys.argv) > 1 else ''
@@ -124,6 +121,12 @@ arg = sys.argv[1] if len(sys.argv) > 1 else ''
 if arg == 'closepost':
   bzz.close_post()
   exit()
+elif arg == 'dump':
+  bzz.dump_thread(sys.argv[2])
+  exit()
+elif arg == 'replay':
+  bzz.replay(sys.argv[2])
+  exit()
 elif arg == 'newpost':
   bzz.create_post()
 else:
@@ -0,0 +1,226 @@
+""" A stand-in Mastodon server for benchmarking. Serves one root post whose
+    thread starts with `descendants` replies and gains `rate` more per
+    second, each a 'bzz' of random length from a random account that
+    mentions us, and so also shows up as a mention notification (with the
+    same id as the status). New replies are also sent to anyone connected
+    to the user stream, which sends a heartbeat every `heartbeat` seconds
+    and can be cut off with `Thread.drop_streams` to test reconnecting.
+    Only the endpoints Bzz uses are implemented.
+"""
+
+import argparse, bisect, datetime, json, queue, random, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ROOT_ID = 1000
+
+def _timestamp(when):
+  return when.strftime('%Y-%m-%dT%H:%M:%S.') + f'{when.microsecond // 1000:03d}Z'
+
+class Thread:
+  """ The root post and its replies, kept pre-encoded so serving a huge
+      thread costs the server a join rather than a json.dumps
+  """
+
+  def __init__(self, descendants, strict_ratio=0.8, seed=0):
+    self.random = random.Random(seed)
+    self.strict_ratio = strict_ratio
+    self.lock = threading.Lock()
+    self.encoded = []
+    self.notifications = []
+    self.ids = []
+    self.streams = []
+    self.next_id = ROOT_ID + 1
+
+    start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=1)
+    for i in range(descendants):
+      self.add(start + datetime.timedelta(seconds=i * 86400 / max(descendants, 1)))
+
+  @property
+  def last_id(self):
+    return self.ids[-1] if self.ids else None
+
+  def add(self, created_at=None):
+    created_at = created_at or datetime.datetime.now(datetime.timezone.utc)
+    with self.lock:
+      status_id = self.next_id
+      self.next_id += 1
+      if self.ids and self.random.random() > self.strict_ratio:
+        parent = self.random.choice(self.ids[-100:])
+      else:
+        parent = ROOT_ID
+      user = f'user{self.random.randrange(5000)}'
+      status = {
+        'id': str(status_id),
+        'in_reply_to_id': str(parent),
+        'created_at': _timestamp(created_at),
+        'content': f'<p><span class="h-card"><a href="https://example.org/@bench">@bench</a></span> b{"z" * self.random.randint(1, 10)}</p>',
+        'spoiler_text': '',
+        'url': f'https://example.org/@{user}/{status_id}',
+        'account': { 'id': str(hash(user) & 0xffffff), 'acct': user, 'username': user },
+      }
+      encoded = json.dumps(status)
+      self.encoded.append(encoded)
+      self.notifications.append(json.dumps({ 'id': str(status_id), 'type': 'mention', 'created_at': status['created_at'],
+        'account': status['account'] })[:-1] + f',"status":{encoded}}}')
+      self.ids.append(status_id)
+      for stream in self.streams:
+        stream.put(self.notifications[-1])
+    return status_id
+
+  def subscribe(self):
+    """ A queue that gets each new reply's notification, or None when the stream should drop """
+    stream = queue.Queue()
+    with self.lock:
+      self.streams.append(stream)
+    return stream
+
+  def unsubscribe(self, stream):
+    with self.lock:
+      if stream in self.streams:
+        self.streams.remove(stream)
+
+  def drop_streams(self):
+    """ Cuts off everyone connected to the stream """
+    with self.lock:
+      for stream in self.streams:
+        stream.put(None)
+      self.streams = []
+
+  def status(self, status_id):
+    with self.lock:
+      index = bisect.bisect_left(self.ids, status_id)
+      if index < len(self.ids) and self.ids[index] == status_id:
+        return self.encoded[index]
+    return None
+
+  def mentions(self, min_id=None, limit=40):
+    """ The page of up to `limit` mention notifications just after min_id (or the newest), newest first """
+    limit = min(limit, 80)
+    with self.lock:
+      if min_id is None:
+        page = self.notifications[-limit:]
+      else:
+        start = bisect.bisect_right(self.ids, min_id)
+        page = self.notifications[start:start + limit]
+    return '[' + ','.join(reversed(page)) + ']'
+
+  def context(self):
+    with self.lock:
+      descendants = ','.join(self.encoded)
+    return f'{{"ancestors":[],"descendants":[{descendants}]}}'
+
+  def arrive(self, rate, stop):
+    """ Adds `rate` replies a second until stop is set """
+    if rate <= 0:
+      return
+    interval = 1 / rate
+    due = time.monotonic()
+    while not stop.is_set():
+      self.add()
+      due += interval
+      stop.wait(max(due - time.monotonic(), 0))
+
+def make_server(thread, host='127.0.0.1', port=0, heartbeat=10):
+  root = json.dumps({
+    'id': str(ROOT_ID), 'in_reply_to_id': None, 'created_at': _timestamp(datetime.datetime.now(datetime.timezone.utc)),
+    'content': '<p>Benchmark post</p>', 'spoiler_text': 'bench', 'url': f'https://example.org/@bench/{ROOT_ID}',
+    'account': { 'id': '1', 'acct': 'bench', 'username': 'bench' },
+  })
+  instance = json.dumps({ 'uri': 'example.org', 'title': 'Bench', 'version': '4.2.0', 'urls': {} })
+  account = json.dumps({ 'id': '1', 'acct': 'bench', 'username': 'bench' })
+
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+      url = urlsplit(self.path)
+      path, query = url.path, parse_qs(url.query)
+      if path == '/api/v1/instance' or path == '/api/v1/instance/':
+        body = instance
+      elif path == '/api/v1/accounts/verify_credentials':
+        body = account
+      elif re.fullmatch(r'/api/v1/statuses/\d+/context', path):
+        body = thread.context()
+      elif path == '/api/v1/streaming/user':
+        self.stream()
+        return
+      elif path == '/api/v1/streaming/health':
+        body = 'OK'
+      elif path == '/api/v1/timelines/public':
+        body = '[]'
+      elif path == '/api/v1/notifications':
+        min_id = int(query['min_id'][0]) if 'min_id' in query else None
+        body = thread.mentions(min_id, int(query.get('limit', ['40'])[0]))
+      elif re.fullmatch(r'/api/v1/statuses/\d+', path):
+        status_id = int(path.rsplit('/', 1)[1])
+        body = root if status_id == ROOT_ID else thread.status(status_id)
+        if body is None:
+          self.send_error(404)
+          return
+      else:
+        self.send_error(404)
+        return
+
+      data = body.encode()
+      self.send_response(200)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(data)))
+      self.end_headers()
+      self.wfile.write(data)
+
+    def stream(self):
+      """ Server-sent events until the client goes or the stream is dropped """
+      events = thread.subscribe()
+      self.close_connection = True
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/event-stream')
+      self.send_header('Connection', 'close')
+      self.end_headers()
+      try:
+        self.wfile.write(b':)\n')
+        self.wfile.flush()
+        while True:
+          try:
+            event = events.get(timeout=heartbeat)
+          except queue.Empty:
+            self.wfile.write(b':thump\n')
+          else:
+            if event is None:
+              return
+            self.wfile.write(f'event: notification\ndata: {event}\n\n'.encode())
+          self.wfile.flush()
+      except OSError:
+        pass
+      finally:
+        thread.unsubscribe(events)
+
+    def log_message(self, format, *args):
+      pass
+
+  return ThreadingHTTPServer((host, port), Handler)
+
+def serve(descendants, rate, port=0, ready=None):
+  """ Builds the thread, starts the arrivals and serves forever. If given,
+      `ready` (a multiprocessing connection) is sent (port, last prefilled id).
+  """
+  thread = Thread(descendants)
+  last_id = thread.last_id
+  server = make_server(thread, port=port)
+  stop = threading.Event()
+  if ready is not None:
+    ready.send((server.server_address[1], last_id))
+  threading.Thread(target=thread.arrive, args=(rate, stop), daemon=True).start()
+  try:
+    server.serve_forever()
+  finally:
+    stop.set()
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--descendants', type=int, default=1000)
+  parser.add_argument('--rate', type=float, default=1)
+  parser.add_argument('--port', type=int, default=8008)
+  args = parser.parse_args()
+  print(f'Serving {args.descendants} replies to {ROOT_ID} on http://127.0.0.1:{args.port}, {args.rate} more a second')
+  serve(args.descendants, args.rate, port=args.port)
@@ -0,0 +1,153 @@
+""" End-to-end benchmark: runs Bzz against a fake Mastodon server (see
+    fake_mastodon.py) with a stub act function, and reports throughput,
+    CPU time per poll, memory and reply-to-action latency.
+
+    python bench/run.py --descendants 1000 --rate 5 --duration 60
+"""
+
+import argparse, datetime, functools, json, logging, multiprocessing, os, resource, sys, tempfile, threading, time, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_mastodon
+from bzz import Bzz
+from bzz.metrics import metrics
+
+def percentile(values, q):
+  if len(values) == 0:
+    return None
+  values = sorted(values)
+  return values[min(int(q * len(values)), len(values) - 1)]
+
+class StubAct:
+  """ Counts acts and records each one's latency from the reply being posted """
+
+  def __init__(self, delay=0):
+    self.delay = delay
+    self.latencies = []
+
+  def __call__(self, item, target_id, config):
+    if self.delay:
+      time.sleep(self.delay)
+    self.latencies.append((datetime.datetime.now(datetime.timezone.utc) - item[2]).total_seconds())
+
+def write_setup(directory, port, last_id, args):
+  """ Writes the creds, token, target and config files Bzz expects, with the
+      cursor set so that only replies arriving during the run are acted on
+  """
+  def write(name, text):
+    with open(os.path.join(directory, name), 'w') as file:
+      file.write(text)
+
+  write('creds.json', json.dumps({ 'mast_username': 'bench', 'mast_password': '', 'mast_appname': 'Bench', 'mast_baseurl': f'http://127.0.0.1:{port}' }))
+  write('Bench_user.secret', f'benchtoken\nhttp://127.0.0.1:{port}\n')
+  write('target.txt', str(fake_mastodon.ROOT_ID))
+  # Notification ids follow status ids in the fake server, so the notification cursor can start at the same place
+  write('last.txt', json.dumps({ 'last_action_id': last_id, 'pending': [], 'notification_cursor': last_id }))
+  write('bench.conf', json.dumps({
+    'name': 'Bench',
+    'parse_interval': args.parse_interval,
+    'act_interval': args.act_interval,
+    'act_burst': args.act_burst,
+    'act_workers': args.act_workers,
+    'strict': args.strict,
+    'fetch_mode': args.fetch_mode,
+  }))
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--descendants', type=int, default=100, help='Replies already in the thread at the start')
+  parser.add_argument('--rate', type=float, default=2, help='New replies per second')
+  parser.add_argument('--duration', type=float, default=20, help='Seconds to run for')
+  parser.add_argument('--parse-interval', type=float, default=1)
+  parser.add_argument('--act-interval', type=float, default=0.05)
+  parser.add_argument('--act-burst', type=int, default=1)
+  parser.add_argument('--act-workers', type=int, default=0)
+  parser.add_argument('--act-delay', type=float, default=0, help='Seconds the stub act function takes')
+  parser.add_argument('--strict', action='store_true')
+  parser.add_argument('--fetch-mode', default='context', choices=['context', 'mentions'])
+  parser.add_argument('--tracemalloc', action='store_true', help='Also report peak traced Python memory (slower)')
+  parser.add_argument('--json', help='Append the results as a JSON line to this file')
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.WARNING)
+
+  # The server gets its own process so its CPU time isn't counted against Bzz
+  print(f'Building a thread of {args.descendants} replies...')
+  ours, theirs = multiprocessing.Pipe()
+  server = multiprocessing.Process(target=fake_mastodon.serve, args=(args.descendants, args.rate), kwargs={ 'ready': theirs }, daemon=True)
+  server.start()
+  port, last_id = ours.recv()
+
+  directory = tempfile.mkdtemp(prefix='bzz-bench-')
+  write_setup(directory, port, last_id, args)
+  os.chdir(directory)
+
+  if args.tracemalloc:
+    tracemalloc.start()
+
+  act = StubAct(args.act_delay)
+  bzz = Bzz(None, act, config_file='./bench.conf')
+  bzz.attach_to_post()
+
+  # Time spent fetching and decoding, on the read thread. Mastodon.py picks the type to decode into
+  # from the calling method's annotations, hence wraps
+  fetch = { 'cpu': 0, 'calls': 0 }
+  def timed(method):
+    @functools.wraps(method)
+    def timed_method(*a, **kw):
+      started = time.thread_time()
+      try:
+        return method(*a, **kw)
+      finally:
+        fetch['cpu'] += time.thread_time() - started
+        fetch['calls'] += 1
+    return timed_method
+  for name in ['status_context', 'notifications', 'status']:
+    setattr(bzz.m, name, timed(getattr(bzz.m, name)))
+
+  print(f'Running for {args.duration}s with {args.rate} replies/s...')
+  cpu_start, wall_start = time.process_time(), time.monotonic()
+  threading.Thread(target=bzz.run, daemon=True).start()
+  time.sleep(args.duration)
+  cpu, wall = time.process_time() - cpu_start, time.monotonic() - wall_start
+
+  polls = sum(x['count'] for x in metrics.poll_seconds.snapshot().values())
+  latencies = list(act.latencies)
+  results = {
+    'descendants': args.descendants,
+    'rate': args.rate,
+    'duration': round(wall, 2),
+    'fetch_mode': args.fetch_mode,
+    'polls': polls,
+    'requests': fetch['calls'],
+    'replies': metrics.new_replies.value(target=bzz.target_id),
+    'acts': len(latencies),
+    'acts_per_second': round(len(latencies) / wall, 2),
+    'cpu_seconds': round(cpu, 3),
+    'cpu_per_poll_ms': round(1000 * cpu / polls, 2) if polls > 0 else None,
+    'fetch_cpu_per_poll_ms': round(1000 * fetch['cpu'] / polls, 2) if polls > 0 else None,
+    'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    'latency_p50_s': percentile(latencies, 0.5),
+    'latency_p99_s': percentile(latencies, 0.99),
+  }
+  if args.tracemalloc:
+    results['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+
+  for name, value in results.items():
+    print(f'{name:>24}: {"n/a" if value is None else round(value, 3) if isinstance(value, float) else value}')
+  if polls == 0:
+    print('Warning: no poll finished during the run, so there are no per-poll figures. Try a longer --duration')
+
+  if args.json:
+    with open(args.json, 'a') as file:
+      file.write(json.dumps(results) + '\n')
+
+  # Bzz runs forever, so don't wait for its threads
+  sys.stdout.flush()
+  server.terminate()
+  os._exit(0)
+
+if __name__ == '__main__':
+  main()
@@ -1,2 +1,7 @@
 from .bzz import Bzz
+from .aio import AsyncBzz
+from .multi import MultiBzz
 from .config import Config
+from .store import TriggerStore
+from .visitors import VisitorRegistry
+from .outputs import OutputGroup
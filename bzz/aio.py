@@ -0,0 +1,108 @@
+import asyncio, logging, os
+from .bzz import Bzz, serve_metrics
+from .target import Target
+from .scheduler import PollScheduler
+from .profiling import install_signal
+from .reload import ConfigWatcher
+from .util import call
+
+log = logging.getLogger(__name__)
+
+class AsyncBzz(Bzz):
+  """ asyncio flavour of Bzz. It's the same Target underneath as Bzz, so
+      queue bounds, act workers, fetch modes and profiling all apply, but
+      polling, parsing and acting are coroutines on the caller's event loop,
+      and any of the parse, act, empty and stats functions may be coroutine
+      functions. Only Mastodon.py calls and plain functions go to worker
+      threads. Start it with `asyncio.run(bzz.run())`.
+  """
+
+  async def create_post(self):
+    try:
+      await asyncio.to_thread(os.remove, self.c.targetfilepath)
+    except FileNotFoundError:
+      pass
+    await self.attach_to_post(existing=False)
+
+  async def attach_to_post(self, existing=True):
+    # Mostly file and terminal I/O, so the sync version is fine off the loop
+    await asyncio.to_thread(Bzz.attach_to_post, self, existing)
+
+  async def dump_thread(self, path):
+    await asyncio.to_thread(Bzz.dump_thread, self, path)
+
+  async def close_post(self):
+    await self.attach_to_post()
+    # If we're closing a post, do so and exit
+    if not self.target_id:
+      print('No current target set; can\'t close off post')
+      exit()
+
+    stats_marker = ' and generating stats' if self.c.close_stats and self.stats_function is not None else ''
+    print(f'Closing post {self.target_id} by appending {self.c.closed_marker} to CW{stats_marker}')
+
+    post = await asyncio.to_thread(lambda: self.m.status(self.target_id))
+    existing_cw = post['spoiler_text']
+    cw_text = f'{existing_cw} {self.c.closed_marker}' if self.c.closed_marker not in existing_cw else existing_cw
+
+    stats_text = ''
+    if self.c.close_stats and self.stats_function is not None:
+      stats_text = await call(self.stats_function, self.target_id, self.c)
+
+    await asyncio.to_thread(self.m.status_update, self.target_id, f'{self.c.post_body}{stats_text}', spoiler_text=cw_text)
+    exit()
+
+  async def _read_loop(self):
+    while True:
+      # Cleared before polling, so a stream gap noticed mid-poll still triggers the next one
+      self.poll_now.clear()
+      await self.scheduler.poll_async(self.target)
+      try:
+        await asyncio.wait_for(self.poll_now.wait(), max(self.target.poll_interval, self.scheduler.spacing()))
+      except asyncio.TimeoutError:
+        pass
+
+  def _stream_status(self, status):
+    # Keep hold of the task, as the loop only keeps a weak reference
+    task = asyncio.ensure_future(self._ingest_streamed(status))
+    self.streamed.add(task)
+    task.add_done_callback(self.streamed.discard)
+
+  async def _ingest_streamed(self, status):
+    try:
+      await self.target.stream_status_async(status)
+    except Exception as e:
+      log.error(f'Unable to ingest streamed status for {self.target_id}: {e}')
+
+  async def run(self):
+    log.info(f'Starting {self.app_name}')
+    await asyncio.to_thread(self.check_credentials)
+
+    if self.c.deny_list:
+      log.info(f'Deny list is {self.c.deny_list}')
+    if self.c.allow_list:
+      log.info(f'Allow list is {self.c.allow_list}')
+
+    loop = asyncio.get_running_loop()
+    self.target = Target(self.target_id, self.parse_function, self.act_function, self.c,
+      empty_function=self.empty_function, device_function=self.device_function)
+    self.queue = self.target.queue
+    self.scheduler = PollScheduler(self.m, [self.target])
+    self.poll_now = asyncio.Event()
+    self.streamed = set()
+
+    if self.c.ingest_mode == 'stream':
+      from .stream import ReplyListener
+      log.info('Connecting to streaming API...')
+      # The listener runs on Mastodon.py's stream thread, so statuses and gaps hop onto the loop
+      listener = ReplyListener(lambda status: loop.call_soon_threadsafe(self._stream_status, status),
+        on_gap=lambda: loop.call_soon_threadsafe(self.poll_now.set))
+      self.stream_handle = await asyncio.to_thread(self.m.stream_user, listener, run_async=True, reconnect_async=True)
+
+    serve_metrics(self.c)
+    install_signal(lambda: self.c)
+
+    if self.c.config_reload_interval is not None:
+      self.watcher = ConfigWatcher(self.config_file_path, self.reconfigure, self.c.config_reload_interval).start()
+
+    await asyncio.gather(self._read_loop(), self.target.act_loop_async())
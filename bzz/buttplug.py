@@ -0,0 +1,170 @@
+import itertools, json, logging, threading, time
+from concurrent.futures import Future
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.client import connect
+
+log = logging.getLogger(__name__)
+
+class ButtplugError(Exception):
+  pass
+
+class ButtplugClient:
+  """ A persistent connection to an Intiface/Buttplug server (message
+      version 3). A background thread owns the websocket: it connects,
+      handshakes and enumerates devices, reads replies and matches them to
+      the command that caused them by message Id, and reconnects with
+      exponential backoff if the connection drops.
+
+      Commands don't wait on each other. `send`, `scalar` and `stop`
+      return a Future that resolves to the reply, so several can be in
+      flight at once; call `.result()` only if you need to know it landed.
+  """
+
+  def __init__(self, url='ws://localhost:12345', client_name='Bzz', backoff=1, max_backoff=30):
+    self.url = url
+    self.client_name = client_name
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+
+    self.devices = {}
+    self.server_info = None
+
+    self._ws = None
+    self._ids = itertools.count(1)
+    self._pending = {}
+    self._lock = threading.Lock()
+    self._ready = threading.Event()
+    self._closed = False
+    self._thread = None
+
+  def start(self):
+    """ Starts connecting in the background """
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, daemon=True)
+      self._thread.start()
+    return self
+
+  def wait_ready(self, timeout=None):
+    """ Blocks until connected and devices are known. Returns False on timeout """
+    return self._ready.wait(timeout)
+
+  def close(self):
+    self._closed = True
+    ws = self._ws
+    if ws is not None:
+      ws.close()
+
+  def default_device(self):
+    """ The lowest device index the server reported, or None if there are no devices """
+    devices = self.devices
+    return min(devices) if len(devices) > 0 else None
+
+  def send(self, message_type, **fields):
+    """ Sends a message and returns a Future for the server's reply """
+    with self._lock:
+      if self._ws is None:
+        raise ConnectionError(f'Not connected to {self.url}')
+      message_id = next(self._ids)
+      future = Future()
+      self._pending[message_id] = future
+      try:
+        self._ws.send(json.dumps([{ message_type: { 'Id': message_id, **fields } }]))
+      except ConnectionClosed as e:
+        del self._pending[message_id]
+        raise ConnectionError(f'Lost connection to {self.url}') from e
+    return future
+
+  def scalar(self, device_index, intensity, actuator='Vibrate', index=0):
+    """ Sets an actuator to intensity, from 0 to 1 """
+    scalars = [{ 'Index': index, 'Scalar': intensity, 'ActuatorType': actuator }]
+    return self.send('ScalarCmd', DeviceIndex=device_index, Scalars=scalars)
+
+  def stop(self, device_index=None):
+    """ Stops one device, or all of them if no index is given """
+    if device_index is None:
+      return self.send('StopAllDevices')
+    return self.send('StopDeviceCmd', DeviceIndex=device_index)
+
+  def _handshake(self):
+    info = self.send('RequestServerInfo', ClientName=self.client_name, MessageVersion=3)
+    devices = self.send('RequestDeviceList')
+
+    # The replies arrive on the read loop we're about to enter, so finish up from their callbacks
+    def finish(_):
+      if info.done() and devices.done() and info.exception() is None and devices.exception() is None:
+        self.server_info = info.result()[1]
+        self.devices = { x['DeviceIndex']: x for x in devices.result()[1]['Devices'] }
+        log.info(f'Connected to {self.url}: {len(self.devices)} devices')
+        self._ready.set()
+
+    info.add_done_callback(finish)
+    devices.add_done_callback(finish)
+
+  def _handle(self, message):
+    for entry in message:
+      for message_type, body in entry.items():
+        if message_type == 'DeviceAdded':
+          self.devices[body['DeviceIndex']] = body
+        elif message_type == 'DeviceRemoved':
+          self.devices.pop(body['DeviceIndex'], None)
+
+        with self._lock:
+          future = self._pending.pop(body.get('Id'), None)
+        if future is None:
+          continue
+        if message_type == 'Error':
+          future.set_exception(ButtplugError(body.get('ErrorMessage')))
+        else:
+          future.set_result((message_type, body))
+
+  def _ping(self, ws):
+    # Servers with a MaxPingTime stop devices if they don't hear from us
+    while self._ws is ws:
+      max_ping = (self.server_info or {}).get('MaxPingTime', 0)
+      if max_ping > 0:
+        try:
+          self.send('Ping')
+        except ConnectionError:
+          return
+        time.sleep(max_ping / 2000)
+      else:
+        time.sleep(1)
+
+  def _drop(self, error):
+    with self._lock:
+      self._ws = None
+      pending, self._pending = self._pending, {}
+    self._ready.clear()
+    for future in pending.values():
+      future.set_exception(error)
+
+  def _run(self):
+    delay = self.backoff
+    while not self._closed:
+      try:
+        ws = connect(self.url)
+      except Exception as e:
+        log.warning(f'Unable to connect to {self.url} ({e}); retrying in {delay}s')
+        time.sleep(delay)
+        delay = min(delay * 2, self.max_backoff)
+        continue
+
+      # Newer websockets versions want the connection entered, and it's closed on the way out either way
+      with ws:
+        with self._lock:
+          self._ws = ws
+        self._handshake()
+        threading.Thread(target=self._ping, args=(ws,), daemon=True).start()
+
+        try:
+          for text in ws:
+            self._handle(json.loads(text))
+            delay = self.backoff
+        except ConnectionClosed:
+          pass
+
+      self._drop(ConnectionError(f'Lost connection to {self.url}'))
+      if not self._closed:
+        log.warning(f'Lost connection to {self.url}; reconnecting in {delay}s')
+        time.sleep(delay)
+        delay = min(delay * 2, self.max_backoff)
@@ -1,9 +1,16 @@
 import logging
 import threading
-import json, os, time
-from mastodon import Mastodon
+import datetime, json, os
 from .config import Config
-from .util import find_index
+from .queue import ActionQueue, Spill
+from .target import Target
+from .scheduler import PollScheduler
+from .rules import RuleSet
+from .metrics import metrics
+from .reload import ConfigWatcher, warn_restart_fields
+from .profiling import install_signal, profiler, start_profiling
+from .replay import Replay, dump_statuses, load_statuses
+from .stats import post_stats
 
 #############################################################
 # Mastodon Creds file should be a JSON file in this format:
@@ -15,55 +22,116 @@ from .util import find_index
 #}
 #############################################################
 
+def load_config(config_file_path):
+  """ Loads a Config, scaffolding a default one and exiting if it doesn't exist yet """
+  try:
+    return Config.from_file(config_file_path)
+  except ValueError as e:
+    print(f'Malformed configuration: {e}')
+    raise
+  except FileNotFoundError as e:
+    print(f'Config file does not exist. Creating a defaulted config under {config_file_path}. Edit this file and re-run!')
+    c = Config()
+    c.save(config_file_path)
+    exit()
+
+def configure_logging(config):
+  """ Sends log output to the terminal, unless the app has set up logging itself """
+  logging.basicConfig(level=logging.DEBUG if config.verbose else logging.INFO, format='%(asctime)s %(message)s', datefmt='%H:%M:%S')
+
+def serve_metrics(config):
+  if config.metrics_port is not None:
+    metrics.serve(config.metrics_port)
+    logging.getLogger(__name__).info(f'Serving metrics at http://127.0.0.1:{config.metrics_port}/metrics')
+
+def read_creds(credsfilepath):
+  # TODO: Should use an actual config library but quick-and-dirty
+  with open(credsfilepath, 'r') as creds_file:
+    return json.loads(creds_file.read())
+
+def log_in(credsfilepath):
+  """ Returns (app name, Mastodon client), registering the app and logging in the first time """
+  from mastodon import Mastodon
+
+  creds = read_creds(credsfilepath)
+
+  clientpath = f'./{creds["mast_appname"]}_client.secret'
+  userpath = f'./{creds["mast_appname"]}_user.secret'
+
+  if not os.path.isfile(userpath):
+    if not os.path.isfile(clientpath):
+      Mastodon.create_app(creds['mast_appname'], api_base_url=creds["mast_baseurl"], to_file=clientpath)
+
+    m = Mastodon(client_id=clientpath)
+    m.log_in(creds["mast_username"], creds["mast_password"], to_file=userpath)
+
+  return creds["mast_appname"], Mastodon(access_token=userpath)
+
 class Bzz:
   def __init__(self, parse_function, act_function, **kwargs):
 
     # Bootstrap our config file
     self.config_file_path = kwargs.get('config_file', './bzz.conf')
-    try:
-      self.c = Config.from_file(self.config_file_path)
-    except ValueError as e:
-      print(f'Malformed configuration: {e}')
-      raise
-    except FileNotFoundError as e:
-      print(f'Config file does not exist. Creating a defaulted config under {self.config_file_path}. Edit this file and re-run!')
-      self.c = Config()
-      self.c.save(self.config_file_path)
-      exit()
+    self.c = load_config(self.config_file_path)
+    configure_logging(self.c)
 
-    self.parse_function = parse_function
+    # Without a parse function, fall back to the rules in the config
+    self.parse_function = parse_function if parse_function is not None else RuleSet.from_config(self.c)
     self.act_function = act_function
-    self.stats_function = kwargs.get('stats_function', None)
-    if self.c.close_stats and self.stats_function is None:
-      print('*** Warning: `close_stats` is true and no stats function is set ***')
+    # Without a stats function, closing a post summarises it from the trigger store
+    self.stats_function = kwargs.get('stats_function', None) or post_stats
 
     self.empty_function = kwargs.get('empty_function', None)
+    self.device_function = kwargs.get('device_function', None)
 
     self.log = logging.getLogger(__name__)
 
-    self.queue = []
+    self.queue = ActionQueue()
     self.read_thread = None
     self.target_id = None
-
-    # Setup Mastodon client
-    # TODO: Should use an actual config library but quick-and-dirty
-    creds = {}
-
-    with open(self.c.credsfilepath, 'r') as creds_file:
-      creds = json.loads(creds_file.read())
-
-    clientpath = f'./{creds["mast_appname"]}_client.secret'
-    userpath = f'./{creds["mast_appname"]}_user.secret'
-
-    if not os.path.isfile(userpath):
-      if not os.path.isfile(clientpath):
-        Mastodon.create_app(creds['mast_appname'], api_base_url=creds["mast_baseurl"], to_file=clientpath)
-
-      m = Mastodon(client_id=clientpath)
-      m.log_in(creds["mast_username"], creds["mast_password"], to_file=userpath)
-
-    self.app_name = creds["mast_appname"]
-    self.m = Mastodon(access_token=userpath)
+    self.target = None
+
+    # The Mastodon client is set up the first time it's needed, so commands that don't talk to Mastodon start quickly
+    self._m = None
+    self._client_lock = threading.Lock()
+    self._verify_thread = None
+    self._credentials_error = None
+
+  @property
+  def app_name(self):
+    return read_creds(self.c.credsfilepath)['mast_appname']
+
+  @property
+  def m(self):
+    """ The Mastodon client, logging in on first use. A cached token is checked in the background """
+    with self._client_lock:
+      if self._m is None:
+        _, self._m = log_in(self.c.credsfilepath)
+        self._verify_thread = threading.Thread(target=self._verify_credentials, daemon=True)
+        self._verify_thread.start()
+      return self._m
+
+  @m.setter
+  def m(self, value):
+    self._m = value
+
+  def _verify_credentials(self):
+    from mastodon import MastodonUnauthorizedError
+    try:
+      self._m.account_verify_credentials()
+    except MastodonUnauthorizedError as e:
+      self._credentials_error = e
+      self.log.error(f'Mastodon rejected the saved token ({e}). Delete {read_creds(self.c.credsfilepath)["mast_appname"]}_user.secret to log in again')
+    except Exception as e:
+      self.log.warning(f'Unable to verify Mastodon credentials: {e}')
+
+  def check_credentials(self):
+    """ Waits for the background token check, raising if Mastodon rejected the token """
+    self.m
+    if self._verify_thread is not None:
+      self._verify_thread.join()
+    if self._credentials_error is not None:
+      raise self._credentials_error
 
   def create_post(self):
     try:
@@ -83,11 +151,13 @@ class Bzz:
         if existing: print(f'Couldn\'t read post ID from file')
 
     if self.target_id is None:
-      # Clear the lastseen file and post a start post
+      # Clear the lastseen file (and any triggers spilled alongside it) and post a start post
       try:
         os.remove(self.c.lastfilepath)
       except FileNotFoundError:
         pass
+      if self.c.queue_spill_path is not None:
+        Spill.remove(self.c.queue_spill_path)
 
       line_length = 70
       body_len = len(self.c.post_body)
@@ -135,87 +205,75 @@ class Bzz:
     self.m.status_update(self.target_id, f'{self.c.post_body}{stats_text}', spoiler_text=cw_text)
     exit()
 
+  def dump_thread(self, path):
+    """ Saves the target post's replies to path, for replaying later """
+    # Not self.attach_to_post, which AsyncBzz makes a coroutine
+    Bzz.attach_to_post(self)
+    statuses = self.m.status_context(self.target_id)['descendants']
+    dump_statuses(statuses, path)
+    print(f'Saved {len(statuses)} replies to {path}')
+
+  def replay(self, path, speed=None, dry_run=True):
+    """ Runs the replies saved in path through parse and act without waiting on
+        the clock, then prints what happened and, if there's a stats function,
+        the stats. Acts are dry runs unless dry_run is False. See Replay.
+    """
+    statuses = load_statuses(path)
+    session = Replay(statuses, self.parse_function, self.c, act_function=None if dry_run else self.act_function,
+      empty_function=self.empty_function, root_id=self.target_id, speed=speed)
+    try:
+      result = session.run()
+      print(f'Replayed {len(statuses)} statuses covering {datetime.timedelta(seconds=int(result["seconds"]))}:')
+      print(f'{result["replies"]} new replies, {result["triggers"]} triggers, {result["acts"]} acts, {result["dropped"]} dropped, {result["errors"]} errors')
+      if self.stats_function is not None:
+        print(session.stats(self.stats_function))
+    finally:
+      session.close()
+
+  def start_profiling(self):
+    """ Starts profiling fetch, parse, act and empty, as set up by the profile_ config fields """
+    start_profiling(self.c)
+
+  def stop_profiling(self):
+    """ Stops profiling and writes the report. Returns its path """
+    return profiler.stop()
+
+  def reconfigure(self, config):
+    """ Swaps in a new config while running. Raises, leaving the old config in place, if it can't be applied """
+    warn_restart_fields(self.c, config)
+    if self.target is not None:
+      self.target.reconfigure(config)
+      self.parse_function = self.target.parse_function
+    self.c = config
+
   def run(self):
-    print(f'\nStarting {self.app_name}')
+    self.log.info(f'Starting {self.app_name}')
+    self.check_credentials()
 
     if self.c.deny_list:
-      print(f'Deny list is {self.c.deny_list}')
+      self.log.info(f'Deny list is {self.c.deny_list}')
     if self.c.allow_list:
-      print(f'Allow list is {self.c.allow_list}')
-
-    self.queue = []
-
-    # Ensure lastfile exists
-    with open(self.c.lastfilepath, 'a'):
-      pass
-
-    self.last_action_id = None
-    try:
-      with open(self.c.lastfilepath, 'r') as file:
-        self.last_action_id = int(file.readlines()[0])
-    except:
-      pass
+      self.log.info(f'Allow list is {self.c.allow_list}')
 
-    def read_method(queue):
-      while True:
-        if self.c.verbose: print(f'Fetching responses. Last seen is {self.last_action_id}')
-        # TODO: This is kind of brute-forcey. Can we filter by last seen time?
-        responses = self.m.status_context(self.target_id)['descendants']
+    self.target = Target(self.target_id, self.parse_function, self.act_function, self.c,
+      empty_function=self.empty_function, device_function=self.device_function)
+    self.queue = self.target.queue
+    self.scheduler = PollScheduler(self.m, [self.target])
 
-        if self.c.strict:
-          target_replies = list(filter(lambda x: x['in_reply_to_id'] == self.target_id, responses))
-        else:
-          target_replies = responses
+    if self.c.ingest_mode == 'stream':
+      from .stream import ReplyListener
+      self.log.info('Connecting to streaming API...')
+      listener = ReplyListener(self.scheduler.dispatch_status, on_gap=self.scheduler.poll_all)
+      self.stream_handle = self.m.stream_user(listener, run_async=True, reconnect_async=True)
 
-        if target_replies == []:
-          time.sleep(self.c.parse_interval)
-          continue
+    serve_metrics(self.c)
+    install_signal(lambda: self.c)
 
-        target_replies.sort(key=lambda x: x['created_at'])
+    if self.c.config_reload_interval is not None:
+      self.watcher = ConfigWatcher(self.config_file_path, self.reconfigure, self.c.config_reload_interval).start()
 
-        subset = []
-
-        if self.last_action_id is None:
-          subset = target_replies
-        else:
-          last_actioned = find_index(lambda x: x['id'] == self.last_action_id, target_replies)
-          subset = target_replies[last_actioned+1:]
-
-        subset = list(subset)
-
-        if len(subset) == 0:
-          if self.c.verbose: print('Nothing to process.')
-
-
-        for item in list(subset):
-          result = self.parse_function(item, self.c)
-          if result:
-            self.queue.append(result)
-
-          self.last_action_id = item['id']
-
-          with open(self.c.lastfilepath, 'w') as file:
-            if self.c.verbose: print(f'Last seen is now {self.last_action_id}')
-            file.writelines([f'{self.last_action_id}'])
-        time.sleep(self.c.parse_interval)
-
-    print('Starting read thread...')
-    self.read_thread = threading.Thread(target=read_method, args=(self.queue,))
+    self.log.info('Starting read thread...')
+    self.read_thread = threading.Thread(target=self.scheduler.run)
     self.read_thread.start()
 
-    while True:
-      try:
-        result = self.act_function(self.queue[0], self.target_id, self.c)
-        if result != False:
-          self.queue.pop(0)
-      except IndexError as e:
-        if self.c.verbose: print('Nothing to send')
-
-        if self.empty_function is not None:
-          result = self.empty_function(self.queue) # Manipulate the queue in some way...
-          if result == True:
-            continue # ...and immediately process it we returned True.
-      except Exception as e:
-        print(e)
-
-      time.sleep(self.c.act_interval)
+    self.target.act_loop()
@@ -0,0 +1,77 @@
+import json, logging, threading, time
+from .util import decode_json, encode_json, write_atomic
+
+log = logging.getLogger(__name__)
+
+class Checkpoint:
+  """ Persists the read cursor and the pending action queue to `path`.
+      Callers `touch` it whenever either changes; writes are coalesced so
+      that at most one happens every `interval` seconds, and each write
+      replaces the file atomically.
+
+      `snapshot` is called at write time and must return a consistent
+      (cursor, pending items) pair, optionally followed by a dict of extra
+      state to save alongside them. The last state loaded is kept in
+      `state`, and `on_write`, if given, is called with each state written.
+  """
+
+  def __init__(self, path, snapshot, interval=1, on_write=None):
+    self.path = path
+    self.snapshot = snapshot
+    self.interval = interval
+    self.on_write = on_write
+    self.state = {}
+    self._lock = threading.Lock()
+    self._timer = None
+    self._last_write = 0
+
+  def load(self):
+    """ Returns (cursor, pending items). Also reads the old format, which was a bare cursor """
+    try:
+      with open(self.path, 'r') as file:
+        state = json.loads(file.read(), object_hook=decode_json)
+    except (FileNotFoundError, ValueError):
+      return None, []
+
+    if isinstance(state, int):
+      return state, []
+    self.state = state
+    return state.get('last_action_id'), state.get('pending', [])
+
+  def touch(self):
+    """ Notes that state has changed. Writes now if we haven't written
+        recently, otherwise schedules a write for the end of the interval.
+    """
+    with self._lock:
+      if self._timer is not None:
+        return
+      delay = self._last_write + self.interval - time.monotonic()
+      if delay > 0:
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+        return
+    self.flush()
+
+  def flush(self):
+    with self._lock:
+      if self._timer is not None:
+        self._timer.cancel()
+        self._timer = None
+
+      snapshot = self.snapshot()
+      cursor, pending = snapshot[:2]
+      extra = snapshot[2] if len(snapshot) > 2 else {}
+      state = dict(extra, last_action_id=cursor, pending=list(pending))
+      try:
+        text = json.dumps(state, default=encode_json)
+      except TypeError as e:
+        log.warning(f'Unable to save pending queue ({e}); saving cursor only')
+        state = dict(extra, last_action_id=cursor, pending=[])
+        text = json.dumps(state)
+
+      write_atomic(self.path, text)
+      self._last_write = time.monotonic()
+
+    if self.on_write is not None:
+      self.on_write(state)
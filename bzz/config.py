@@ -14,7 +14,13 @@ class Config:
   """ default config. Any of these can be overwritten """
 
   allowed_values = {
-    'post_privacy': AllowedValue(['direct', 'private', 'unlisted', 'public'])
+    'post_privacy': AllowedValue(['direct', 'private', 'unlisted', 'public']),
+    'ingest_mode': AllowedValue(['poll', 'stream']),
+    'fetch_mode': AllowedValue(['context', 'mentions']),
+    'act_coalesce': AllowedValue([None, 'max', 'sum', 'latest']),
+    'parse_pool': AllowedValue(['thread', 'process']),
+    'queue_shed': AllowedValue(['oldest', 'lowest', 'sample']),
+    'profile_mode': AllowedValue(['sample', 'cprofile']),
   }
 
   def __post_init__(self):
@@ -22,18 +28,58 @@ class Config:
       if field in self.__dict__:
         test.run(self.__dict__[field], field)
 
+    # Account names are compared case-insensitively
+    for field in ['deny_list', 'allow_list']:
+      if self.__dict__.get(field) is not None:
+        self.__dict__[field] = [ x.casefold() for x in self.__dict__[field] ]
+
   name: str = 'Default' # The name for this app
 
   deny_list: list = None # List of account names. If set, these users will not trigger a response
   allow_list: list = None # List of account names. If set, these are the only users who will trigger a response
 
-  parse_interval: int = 10 # The time between attempts to poll the target post
+  parse_interval: int = 10 # The time between attempts to poll the target post, to begin with
+
+  poll_min_interval: float = 2 # The shortest time between polls, while replies keep arriving
+  poll_max_interval: float = 60 # The longest time between polls, while they don't
+  poll_backoff: float = 1.5 # How many times longer the interval gets after each quiet poll
   act_interval: int = 5 # The minimum space between triggers
-  verbose: bool = False # Replace with loglevels
+  act_burst: int = 1 # How many triggers can go out back to back after a quiet spell, still averaging one per act_interval
+  act_max_age: int = None # If set, triggers sent longer ago than this many seconds are dropped rather than acted on
+  act_coalesce: str = None # 'max', 'sum' or 'latest': merge the triggers waiting in the queue into one
+  act_coalesce_window: int = None # If set, only merge triggers sent within this many seconds of the oldest one
+
+  act_workers: int = 0 # If set, act calls run off the act loop, up to this many at once
+  act_timeout: int = 30 # Seconds each act call gets, with act_workers set
+  act_retries: int = 2 # How many times an act call that raises is tried again
+  act_retry_backoff: float = 1 # Seconds before the first retry, doubling for each one after
+  act_breaker_threshold: int = 5 # Failed triggers in a row before an output's triggers are dropped for a while
+  act_breaker_reset: int = 60 # How many seconds they're dropped for
+  parse_workers: int = 0 # If set, each batch of new replies is parsed on a pool of this many workers
+  parse_pool: str = 'thread' # 'thread' or 'process': what the parse_workers pool is made of
+  queue_memory_limit: int = None # If set, the most triggers kept in memory; the rest spill to queue_spill_path or are shed
+  queue_limit: int = None # If set, the most triggers waiting in total; past it, one is shed per new trigger
+  queue_shed: str = 'oldest' # 'oldest', 'lowest' or 'sample': which trigger is shed
+  queue_spill_path: str = None # If set, triggers past queue_memory_limit are written to numbered files here
+  checkpoint_interval: float = 1 # The minimum time between writes of the cursor and pending queue to lastfilepath
+  config_reload_interval: float = 2 # How often to check the config file for changes while running. None turns reloading off
+  verbose: bool = False # Log at DEBUG rather than INFO
+  profile_mode: str = 'sample' # 'sample' or 'cprofile': how profiling (toggled with SIGUSR1) finds the busy stacks
+  profile_path: str = './profile.txt' # Where the report is written when profiling stops
+  profile_interval: float = 0.005 # Seconds between stack samples in 'sample' mode
+  metrics_port: int = None # If set, serve Prometheus metrics at http://127.0.0.1:<port>/metrics
+
+  ingest_mode: str = 'poll' # 'poll', or 'stream' to take replies from the user stream as they arrive
+  stream_fallback_interval: int = 60 # In 'stream' mode, how often to poll anyway to fill any gaps
+  fetch_mode: str = 'context' # 'context' fetches the whole thread each poll, 'mentions' only new mention notifications
 
   closed_marker: str = '[FINISHED]' # Appended to a post's CW when closing it
   close_stats: bool = False # Whether to generate stats on close
 
+  rules: list = None # Built-in trigger rules, used when no parse function is given. Defaults to matching 'bz' to 'bzzzzzzzzzz'
+
+  output_scales: dict = None # Intensity multipliers for an OutputGroup's devices by name, e.g. {"pishock": 0.5}
+
   # If True, only direct responses to the original post will be counted. If False, all children are considered
   strict: bool = False
 
@@ -42,8 +88,8 @@ class Config:
   post_privacy: str = 'unlisted'
 
   # File paths - files are used for storing some mostly ephemeral stuff and also config/logs
-  # TODO: Should use actual Python logging but this is quick-and-dirty
-  logfilepath: str = './log.txt' # logfile
+  logfilepath: str = './log.txt' # CSV trigger log from older versions, imported into the trigger store once
+  storefilepath: str = './triggers.db' # SQLite trigger store, used for stats
   lastfilepath: str = './last.txt' # last processed file
   credsfilepath: str = './creds.json' # credentials file
   targetfilepath: str = './target.txt' # target_id for current post
@@ -0,0 +1,184 @@
+import logging, threading, time
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+from .util import LoopWaiters
+
+log = logging.getLogger(__name__)
+
+class Lane:
+  """ The jobs for one device, run strictly in order, plus its circuit breaker """
+
+  def __init__(self, key):
+    self.key = key
+    self.jobs = deque()
+    self.running = None
+    self.failures = 0
+    self.open_until = 0
+    self.thread = None
+    self.call = None # The last call's Future, which may still be running if it timed out
+
+class ActDispatcher:
+  """ Runs act calls off the act loop, up to `workers` at once, so a slow
+      or hung output doesn't stall it.
+
+      Calls are grouped into lanes by a device key. Each lane runs its jobs
+      one at a time and in order, while different lanes run side by side.
+      Each call is given `timeout` seconds. Exceptions are retried up to
+      `retries` times with exponential backoff starting at `backoff`
+      seconds. A call that returns False is treated as busy, the same as in
+      the act loop, and retried after `backoff` without counting as a
+      failure.
+
+      A call that times out may still go through, so it isn't retried; the
+      job counts as failed. It keeps running on its own thread but stops
+      counting towards `workers`, so it can't starve the other lanes. Until
+      it finishes, its lane's jobs fail without being tried, rather than
+      driving the device twice at once.
+
+      After `threshold` failed jobs in a row a lane's breaker opens, and
+      its jobs are dropped without being tried for `reset` seconds. The
+      first job after that decides whether the breaker closes again.
+
+      `on_done` is called once each job is finished with, however it went.
+
+      Lanes don't limit how many jobs wait in them, so callers should hold
+      on to work until `wait_idle` says its lane is free. That way it stays
+      wherever they queue it, bounded and shaped, rather than piling up here.
+  """
+
+  def __init__(self, workers=4, timeout=30, retries=2, backoff=1, threshold=5, reset=60, on_done=None):
+    self.timeout = timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.threshold = threshold
+    self.reset = reset
+    self.on_done = on_done
+    self._slots = threading.BoundedSemaphore(workers)
+    self._lanes = {}
+    self._lock = threading.Lock()
+    self._idle = threading.Condition(self._lock)
+    self._waiters = LoopWaiters()
+
+  @classmethod
+  def from_config(cls, config, on_done=None):
+    return cls(workers=config.act_workers, timeout=config.act_timeout, retries=config.act_retries,
+      backoff=config.act_retry_backoff, threshold=config.act_breaker_threshold, reset=config.act_breaker_reset,
+      on_done=on_done)
+
+  def reconfigure(self, config):
+    """ Applies new timeouts, retries and breaker settings. The number of workers is fixed """
+    self.timeout = config.act_timeout
+    self.retries = config.act_retries
+    self.backoff = config.act_retry_backoff
+    self.threshold = config.act_breaker_threshold
+    self.reset = config.act_breaker_reset
+
+  def submit(self, key, function, item, *args):
+    """ Queues function(item, *args) on key's lane and returns straight away """
+    with self._lock:
+      lane = self._lanes.get(key)
+      if lane is None:
+        lane = self._lanes[key] = Lane(key)
+      lane.jobs.append((function, item, args))
+      if lane.thread is None:
+        lane.thread = threading.Thread(target=self._run_lane, args=(lane,), daemon=True)
+        lane.thread.start()
+
+  def _busy(self, key):
+    lane = self._lanes.get(key)
+    return lane is not None and (lane.running is not None or len(lane.jobs) > 0)
+
+  def idle(self, key):
+    """ True if key's lane has nothing running or waiting """
+    with self._lock:
+      return not self._busy(key)
+
+  def wait_idle(self, key, timeout=None):
+    """ Waits up to timeout seconds for key's lane to be idle. Returns True if it is """
+    with self._idle:
+      return self._idle.wait_for(lambda: not self._busy(key), timeout)
+
+  async def wait_idle_async(self, key, timeout=None):
+    """ wait_idle for asyncio: waits on the running loop rather than blocking it """
+    return await self._waiters.wait_for(self._idle, lambda: not self._busy(key), timeout)
+
+  def pending(self):
+    """ Items submitted but not yet completed, in lane order, for checkpointing """
+    with self._lock:
+      items = []
+      for lane in self._lanes.values():
+        if lane.running is not None:
+          items.append(lane.running)
+        items.extend(item for _, item, _ in lane.jobs)
+      return items
+
+  def _run_lane(self, lane):
+    while True:
+      with self._lock:
+        if len(lane.jobs) == 0:
+          lane.thread = None
+          return
+        function, item, args = lane.jobs.popleft()
+        lane.running = item
+
+      if time.monotonic() < lane.open_until:
+        log.warning(f'Dropping trigger for {lane.key}: output is failing')
+      elif self._attempt(lane, function, item, args):
+        lane.failures = 0
+      else:
+        lane.failures += 1
+        if lane.failures >= self.threshold:
+          log.warning(f'Pausing {lane.key} for {self.reset}s after {lane.failures} failures')
+          lane.open_until = time.monotonic() + self.reset
+          lane.failures = self.threshold - 1 # One more failure after the pause reopens it
+
+      with self._lock:
+        lane.running = None
+        self._idle.notify_all()
+        self._waiters.wake()
+      if self.on_done is not None:
+        self.on_done()
+
+  def _start(self, lane, function, item, args):
+    """ Runs function(item, *args) on a thread of its own, which a hung call can keep without holding anyone else up """
+    call = Future()
+
+    def run():
+      try:
+        call.set_result(function(item, *args))
+      except BaseException as e:
+        call.set_exception(e)
+
+    threading.Thread(target=run, name=f'bzz-act-{lane.key}', daemon=True).start()
+    return call
+
+  def _attempt(self, lane, function, item, args):
+    """ Calls function until it succeeds or runs out of retries. Returns True on success """
+    failures = 0
+    while True:
+      if lane.call is not None and not lane.call.done():
+        log.warning(f'Act for {lane.key} skipped: its last call timed out and is still running')
+        return False
+
+      error = None
+      with self._slots:
+        lane.call = self._start(lane, function, item, args)
+        try:
+          result = lane.call.result(timeout=self.timeout)
+        except TimeoutError:
+          log.warning(f'Act for {lane.key} timed out after {self.timeout}s, not retrying as it may still go through')
+          return False
+        except Exception as e:
+          error = e
+
+      if error is None:
+        if result != False:
+          return True
+        time.sleep(self.backoff)
+        continue
+
+      log.warning(f'Act for {lane.key} failed: {error}')
+      failures += 1
+      if failures > self.retries:
+        return False
+      time.sleep(self.backoff * 2 ** (failures - 1))
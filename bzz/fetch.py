@@ -0,0 +1,133 @@
+import logging
+from collections import OrderedDict
+from .thread import _id
+
+log = logging.getLogger(__name__)
+
+def _get(status, key):
+  return status.get(key) if isinstance(status, dict) else getattr(status, key, None)
+
+class ContextFetcher:
+  """ Fetches the post's whole thread each poll with `status_context` """
+
+  def __init__(self, target_id):
+    self.target_id = target_id
+
+  def fetch(self, m):
+    return m.status_context(self.target_id)['descendants']
+
+  def commit(self):
+    pass
+
+  def state(self):
+    return {}
+
+class MentionFetcher:
+  """ Fetches only what's new each poll by paging through our mention
+      notifications with `min_id`, so a poll costs the same however big the
+      thread has got. The notification cursor is separate from the status
+      cursor and is kept in the checkpoint; with no saved cursor, the first
+      poll fetches the whole thread once to catch up.
+
+      A mention counts if its `in_reply_to_id` chain reaches the post.
+      Parents we don't already know about are fetched and remembered (up
+      to `cache_size` of them), and replies in the chain that didn't
+      mention us are returned too. Replies that don't mention us and
+      aren't above one that does are never seen, unlike with a whole-thread
+      fetch.
+
+      The cursor only moves on `commit`, once the replies have been
+      ingested, so a failed poll is fetched again.
+  """
+
+  def __init__(self, target_id, thread, cursor=None, page_size=40, max_pages=10, cache_size=10000):
+    self.target_id = _id(target_id)
+    self.thread = thread
+    self.cursor = cursor
+    self.page_size = page_size
+    self.max_pages = max_pages
+    self.cache_size = cache_size
+    self.parents = OrderedDict() # status id: parent id, for statuses fetched while walking up chains
+    self.outside = OrderedDict() # status ids known not to be under the post
+    self._next_cursor = cursor
+
+  def _remember(self, cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > self.cache_size:
+      cache.popitem(last=False)
+
+  def _latest(self, m):
+    page = m.notifications(types=['mention'], limit=1)
+    return _id(page[0]['id']) if len(page) > 0 else 0
+
+  def fetch(self, m):
+    if self.cursor is None:
+      # Note where the notifications are up to before fetching, so nothing can fall in between
+      self._next_cursor = self._latest(m)
+      log.info(f'Catching up on {self.target_id} before fetching mentions from {self._next_cursor}')
+      return m.status_context(self.target_id)['descendants']
+
+    statuses = []
+    cursor = self.cursor
+    for _ in range(self.max_pages):
+      page = m.notifications(types=['mention'], min_id=cursor, limit=self.page_size)
+      if len(page) == 0:
+        break
+      cursor = max(_id(x['id']) for x in page)
+      statuses.extend(x['status'] for x in page if x.get('status') is not None)
+      if len(page) < self.page_size:
+        break
+    self._next_cursor = cursor
+
+    found = {}
+    for status in statuses:
+      for x in self.chain(m, status):
+        found[_id(x['id'])] = x
+    return list(found.values())
+
+  def chain(self, m, status):
+    """ The status and any fetched ancestors of it if it's under the post, or [] if it isn't """
+    chain = [status]
+    parent = _id(_get(status, 'in_reply_to_id'))
+    while True:
+      if parent is None or parent in self.outside:
+        break
+      if self.thread.contains(parent):
+        return chain
+      # Ids are time-ordered, so nothing older than the post can be under it
+      if isinstance(parent, int) and isinstance(self.target_id, int) and parent < self.target_id:
+        break
+
+      if parent in self.parents:
+        self.parents.move_to_end(parent)
+        parent = self.parents[parent]
+        continue
+
+      try:
+        ancestor = m.status(parent)
+      except Exception as e:
+        # A deleted or hidden parent cuts the chain; anything else fails the poll so it's tried again
+        from mastodon import MastodonNotFoundError
+        if not isinstance(e, MastodonNotFoundError):
+          raise
+        log.debug(f'Unable to fetch {parent}: {e}')
+        break
+      self._remember(self.parents, parent, _id(_get(ancestor, 'in_reply_to_id')))
+      chain.append(ancestor)
+      parent = self.parents[parent]
+
+    for x in chain:
+      self._remember(self.outside, _id(x['id']), True)
+    return []
+
+  def commit(self):
+    self.cursor = self._next_cursor
+
+  def state(self):
+    return { 'notification_cursor': self.cursor } if self.cursor is not None else {}
+
+def make_fetcher(config, target_id, thread, state=None):
+  if config.fetch_mode == 'mentions':
+    return MentionFetcher(target_id, thread, cursor=(state or {}).get('notification_cursor'))
+  return ContextFetcher(target_id)
@@ -0,0 +1,178 @@
+import bisect, threading
+
+def _key(labels):
+  return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+  pairs = list(key) + list(extra)
+  if len(pairs) == 0:
+    return ''
+  return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+class Counter:
+  def __init__(self, name, help):
+    self.name, self.help, self.type = name, help, 'counter'
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def inc(self, amount=1, **labels):
+    key = _key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def value(self, **labels):
+    return self._values.get(_key(labels), 0)
+
+  def snapshot(self):
+    with self._lock:
+      return { key: value for key, value in self._values.items() }
+
+  def render(self):
+    return [ f'{self.name}{_format_labels(key)} {value}' for key, value in self.snapshot().items() ]
+
+class Gauge:
+  """ A value that goes up and down. If `function` is given it's called with
+      no arguments at read time and returns {labels tuple: value}.
+  """
+
+  def __init__(self, name, help, function=None):
+    self.name, self.help, self.type = name, help, 'gauge'
+    self.function = function
+    self._values = {}
+
+  def set(self, value, **labels):
+    self._values[_key(labels)] = value
+
+  def value(self, **labels):
+    return self.snapshot().get(_key(labels), 0)
+
+  def snapshot(self):
+    if self.function is not None:
+      return self.function()
+    return dict(self._values)
+
+  def render(self):
+    return [ f'{self.name}{_format_labels(key)} {value}' for key, value in self.snapshot().items() ]
+
+class Histogram:
+  def __init__(self, name, help, buckets):
+    self.name, self.help, self.type = name, help, 'histogram'
+    self.buckets = sorted(buckets)
+    self._series = {}
+    self._lock = threading.Lock()
+
+  def observe(self, value, **labels):
+    key = _key(labels)
+    with self._lock:
+      series = self._series.get(key)
+      if series is None:
+        series = self._series[key] = { 'counts': [0] * (len(self.buckets) + 1), 'sum': 0, 'count': 0 }
+      series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+      series['sum'] += value
+      series['count'] += 1
+
+  def snapshot(self):
+    """ Returns {labels tuple: {'buckets': [(upper bound, cumulative count)], 'sum', 'count'}} """
+    with self._lock:
+      result = {}
+      for key, series in self._series.items():
+        running, buckets = 0, []
+        for bound, count in zip(self.buckets + [float('inf')], series['counts']):
+          running += count
+          buckets.append((bound, running))
+        result[key] = { 'buckets': buckets, 'sum': series['sum'], 'count': series['count'] }
+      return result
+
+  def quantile(self, q, **labels):
+    """ An estimate of the q quantile: the upper bound of the bucket it falls in """
+    series = self.snapshot().get(_key(labels))
+    if series is None or series['count'] == 0:
+      return None
+    target = q * series['count']
+    for bound, running in series['buckets']:
+      if running >= target:
+        return bound
+    return float('inf')
+
+  def render(self):
+    lines = []
+    for key, series in self.snapshot().items():
+      for bound, running in series['buckets']:
+        le = '+Inf' if bound == float('inf') else bound
+        lines.append(f'{self.name}_bucket{_format_labels(key, [("le", le)])} {running}')
+      lines.append(f'{self.name}_sum{_format_labels(key)} {series["sum"]}')
+      lines.append(f'{self.name}_count{_format_labels(key)} {series["count"]}')
+    return lines
+
+_seconds = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+class Metrics:
+  """ The numbers Bzz keeps about itself. Read them from Python with
+      `snapshot()`, or as Prometheus text with `render()` or over HTTP
+      with `serve()`.
+  """
+
+  def __init__(self):
+    self.poll_seconds = Histogram('bzz_poll_seconds', 'Time taken to fetch a thread', _seconds)
+    self.poll_errors = Counter('bzz_poll_errors_total', 'Fetches that failed')
+    self.poll_replies = Histogram('bzz_poll_replies', 'Replies returned per fetch', [0, 1, 10, 100, 1000, 10000, 100000])
+    self.new_replies = Counter('bzz_replies_total', 'Replies seen for the first time')
+    self.parse_seconds = Histogram('bzz_parse_seconds', 'Time taken by the parse function per reply', _seconds)
+    self.triggers = Counter('bzz_triggers_total', 'Replies that parsed into a trigger')
+    self.dropped = Counter('bzz_dropped_total', 'Triggers dropped as stale')
+    self.shed = Counter('bzz_shed_total', 'Triggers shed because the queue was full')
+    self.act_seconds = Histogram('bzz_act_seconds', 'Time taken by the act function', _seconds)
+    self.act_latency = Histogram('bzz_action_latency_seconds', 'Time from a reply being posted to it being acted on', _seconds)
+    self.acts = Counter('bzz_acts_total', 'Act calls that completed')
+    self.act_errors = Counter('bzz_act_errors_total', 'Act calls that raised')
+    self.output_errors = Counter('bzz_output_errors_total', 'Output group devices that raised or timed out')
+    self.queue_depth = Gauge('bzz_queue_depth', 'Triggers waiting to be acted on', self._queue_depths)
+    self._queues = {}
+
+  def all(self):
+    return [ x for x in self.__dict__.values() if isinstance(x, (Counter, Gauge, Histogram)) ]
+
+  def track_queue(self, queue, **labels):
+    """ Reports len(queue) as the queue depth for these labels """
+    self._queues[_key(labels)] = queue
+
+  def _queue_depths(self):
+    return { key: len(queue) for key, queue in list(self._queues.items()) }
+
+  def snapshot(self):
+    return { metric.name: metric.snapshot() for metric in self.all() }
+
+  def render(self):
+    lines = []
+    for metric in self.all():
+      lines.append(f'# HELP {metric.name} {metric.help}')
+      lines.append(f'# TYPE {metric.name} {metric.type}')
+      lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+  def serve(self, port, host='127.0.0.1'):
+    """ Serves render() at /metrics from a background thread. Returns the server """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    metrics = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        if self.path != '/metrics':
+          self.send_error(404)
+          return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Shared by everything in the process
+metrics = Metrics()
@@ -0,0 +1,67 @@
+import dataclasses, logging, threading
+from .bzz import configure_logging, load_config, log_in, serve_metrics
+from .target import Target
+from .scheduler import PollScheduler
+from .profiling import install_signal
+
+log = logging.getLogger(__name__)
+
+class MultiBzz:
+  """ Watches several posts from one process and one Mastodon login.
+      Each target gets its own cursor, queue, act loop and config (so its
+      own allow/deny lists and intervals), while a single scheduler shares
+      the polling budget between them.
+
+      The base config supplies the credentials and ingest mode. Targets
+      use it too unless they pass their own `config_file`, and any extra
+      keyword arguments override individual fields for that target, e.g.
+      `lastfilepath='./last-2.txt'`.
+  """
+
+  def __init__(self, config_file='./bzz.conf'):
+    self.c = load_config(config_file)
+    configure_logging(self.c)
+    self.app_name, self.m = log_in(self.c.credsfilepath)
+    self.targets = []
+    self.scheduler = PollScheduler(self.m)
+    self.act_threads = []
+
+  def add_target(self, target_id, parse_function, act_function, config_file=None, empty_function=None, device_function=None, **overrides):
+    config = load_config(config_file) if config_file is not None else self.c
+    if overrides:
+      config = dataclasses.replace(config, **overrides)
+
+    for target in self.targets:
+      if target.c.lastfilepath == config.lastfilepath:
+        raise ValueError(f'Targets {target.target_id} and {target_id} share lastfilepath {config.lastfilepath}')
+      if config.queue_spill_path is not None and target.c.queue_spill_path == config.queue_spill_path:
+        raise ValueError(f'Targets {target.target_id} and {target_id} share queue_spill_path {config.queue_spill_path}')
+
+    target = Target(target_id, parse_function, act_function, config, empty_function=empty_function, device_function=device_function)
+    self.targets.append(target)
+    self.scheduler.add(target)
+    return target
+
+  def run(self):
+    log.info(f'Starting {self.app_name} for {len(self.targets)} posts')
+
+    if self.c.ingest_mode == 'stream':
+      from .stream import ReplyListener
+      log.info('Connecting to streaming API...')
+      listener = ReplyListener(self.scheduler.dispatch_status, on_gap=self.scheduler.poll_all)
+      self.stream_handle = self.m.stream_user(listener, run_async=True, reconnect_async=True)
+
+    serve_metrics(self.c)
+    install_signal(lambda: self.c)
+
+    log.info('Starting read thread...')
+    read_thread = threading.Thread(target=self.scheduler.run, daemon=True)
+    read_thread.start()
+
+    for target in self.targets:
+      thread = threading.Thread(target=target.act_loop, daemon=True)
+      thread.start()
+      self.act_threads.append(thread)
+
+    for thread in self.act_threads:
+      thread.join()
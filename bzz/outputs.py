@@ -0,0 +1,100 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from .metrics import metrics
+
+log = logging.getLogger(__name__)
+
+class Output:
+  """ One device in an OutputGroup: an act-style function plus how much to scale intensities sent to it """
+
+  def __init__(self, name, function, scale=1):
+    self.name = name
+    self.function = function
+    self.scale = scale
+    self.call = None # The last call's Future, which may still be running if it timed out
+
+class OutputGroup:
+  """ An act function that sends each trigger to several devices at once.
+
+      Each device gets its own copy of the trigger with the intensity
+      multiplied by its scale (capped at `max_intensity`), and is called as
+      `function(item, target_id, config)` like any act function. Calls run
+      side by side, so adding a device doesn't add to each trigger's
+      latency, and `timeout` (if set) bounds how long we wait for them.
+
+      A scale in the config's `output_scales`, by device name, overrides
+      the one given to `add`, so scales can be changed on a reload.
+
+      Returns {name: True or False} for each device, or False if every
+      device returned False (busy), so that the act loop tries again.
+      Devices that raise or time out count as False and are logged, but
+      aren't busy, so they don't make the group try again. A device whose
+      last call timed out and is still running isn't called again until it
+      finishes; it counts as failed in the meantime.
+  """
+
+  def __init__(self, max_intensity=100, timeout=None):
+    self.outputs = []
+    self.max_intensity = max_intensity
+    self.timeout = timeout
+    self._pool = None
+
+  def add(self, name, function, scale=1):
+    self.outputs.append(Output(name, function, scale))
+    self._pool = None
+    return self
+
+  def scale_for(self, output, config):
+    scales = getattr(config, 'output_scales', None) or {}
+    return scales.get(output.name, output.scale)
+
+  def scaled(self, item, scale):
+    """ A copy of a [intensity, ...] trigger with the intensity scaled. Anything else is passed through """
+    if scale == 1 or not isinstance(item, (list, tuple)) or len(item) == 0 or not isinstance(item[0], (int, float)):
+      return item
+    scaled = list(item)
+    scaled[0] = min(round(item[0] * scale), self.max_intensity)
+    return scaled
+
+  def _call(self, output, item, target_id, config):
+    """ True if the device took the trigger, False if it was busy, or None if it failed """
+    try:
+      return output.function(item, target_id, config) != False
+    except Exception as e:
+      return self._failed(output.name, f'failed: {e}')
+
+  def _failed(self, name, reason):
+    metrics.output_errors.inc(output=name)
+    log.warning(f'Output {name} {reason}')
+    return None
+
+  def __call__(self, item, target_id, config):
+    if len(self.outputs) == 0:
+      results = {}
+    elif len(self.outputs) == 1 and self.timeout is None:
+      output = self.outputs[0]
+      results = { output.name: self._call(output, self.scaled(item, self.scale_for(output, config)), target_id, config) }
+    else:
+      if self._pool is None:
+        self._pool = ThreadPoolExecutor(max_workers=len(self.outputs), thread_name_prefix='bzz-output')
+      # Each device has one worker, so one that's still stuck on its last call is skipped rather than queued
+      results = {}
+      for output in self.outputs:
+        if output.call is not None and not output.call.done():
+          results[output.name] = self._failed(output.name, 'skipped: its last call timed out and is still running')
+          continue
+        output.call = self._pool.submit(self._call, output, self.scaled(item, self.scale_for(output, config)), target_id, config)
+      calls = { output.name: output.call for output in self.outputs if output.name not in results }
+      wait(calls.values(), timeout=self.timeout)
+
+      for name, call in calls.items():
+        if call.done():
+          results[name] = call.result()
+        else:
+          results[name] = self._failed(name, f'timed out after {self.timeout}s')
+
+    log.debug(f'Output results: {results}')
+    # Only retry if everything was busy; a device that failed or timed out may have gone off, so isn't tried again
+    if len(results) > 0 and all(x is False for x in results.values()):
+      return False
+    return { name: x is True for name, x in results.items() }
@@ -0,0 +1,74 @@
+import asyncio, inspect, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .profiling import profiler
+
+def _timed(parse_function, item, config):
+  """ Returns (parse result, seconds taken). Module level so process pools can pickle it """
+  started = time.perf_counter()
+  with profiler.phase('parse'):
+    result = parse_function(item, config)
+  return result, time.perf_counter() - started
+
+async def _timed_async(parse_function, item, config):
+  started = time.perf_counter()
+  with profiler.phase('parse'):
+    result = await parse_function(item, config)
+  return result, time.perf_counter() - started
+
+class ParseStage:
+  """ Runs a parse function over a batch of new replies. With `workers`
+      set the batch is spread over a pool of that many threads, or
+      processes if `kind` is 'process', for parse functions heavy enough to
+      hold up the next poll. Either way the results come back in the
+      batch's order.
+
+      A process pool needs the parse function, replies and config to
+      pickle; the built-in RuleSet does.
+
+      Under asyncio, `map_async` awaits a coroutine parse function on the
+      loop, with up to `workers` replies in flight at once, and hands a plain
+      one to `map` on a worker thread.
+  """
+
+  def __init__(self, workers=0, kind='thread'):
+    self.workers = workers
+    self.kind = kind
+    self._pool = None
+
+  @classmethod
+  def from_config(cls, config):
+    return cls(workers=config.parse_workers, kind=config.parse_pool)
+
+  def _executor(self):
+    if self._pool is None:
+      pool = ProcessPoolExecutor if self.kind == 'process' else ThreadPoolExecutor
+      self._pool = pool(max_workers=self.workers)
+    return self._pool
+
+  def map(self, parse_function, items, config):
+    """ Returns [(result, seconds)] for items, in order. Raises if any parse raised """
+    if self.workers <= 0 or len(items) <= 1:
+      return [ _timed(parse_function, item, config) for item in items ]
+
+    # Big enough chunks that a process pool isn't all pickling
+    chunksize = max(len(items) // (self.workers * 4), 1) if self.kind == 'process' else 1
+    count = len(items)
+    return list(self._executor().map(_timed, [parse_function] * count, items, [config] * count, chunksize=chunksize))
+
+  async def map_async(self, parse_function, items, config):
+    """ map for asyncio """
+    if not inspect.iscoroutinefunction(parse_function):
+      return await asyncio.to_thread(self.map, parse_function, items, config)
+    if self.workers <= 0 or len(items) <= 1:
+      return [ await _timed_async(parse_function, item, config) for item in items ]
+
+    limit = asyncio.Semaphore(self.workers)
+    async def timed(item):
+      async with limit:
+        return await _timed_async(parse_function, item, config)
+    return await asyncio.gather(*(timed(item) for item in items))
+
+  def shutdown(self):
+    if self._pool is not None:
+      self._pool.shutdown(wait=False)
+      self._pool = None
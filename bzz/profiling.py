@@ -0,0 +1,172 @@
+import cProfile, datetime, io, logging, pstats, sys, threading, time, traceback
+from collections import Counter
+from contextlib import nullcontext
+
+log = logging.getLogger(__name__)
+
+_off = nullcontext()
+
+class _Phase:
+  def __init__(self, profiler, name):
+    self.profiler = profiler
+    self.name = name
+
+  def __enter__(self):
+    self.profiler._enter(self.name)
+    self.started = time.perf_counter()
+
+  def __exit__(self, *exc):
+    self.profiler._exit(self.name, time.perf_counter() - self.started)
+
+class Profiler:
+  """ Profiles the fetch, parse, act and empty phases of a running Bzz on
+      demand. While it's off, entering a phase costs one attribute check.
+
+      While it's on, every phase is timed, and either:
+      - 'sample' mode looks at what each thread that's inside a phase is
+        running every `interval` seconds, and counts the stacks it sees
+      - 'cprofile' mode runs cProfile on each thread while it's in a phase
+      `stop` writes the per-phase timings and the top stacks (or functions,
+      for cProfile) to `path`.
+
+      Parse functions run in a process pool aren't seen; only the wait for
+      them is.
+  """
+
+  def __init__(self):
+    self.running = False
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    self._reset()
+
+  def _reset(self):
+    self.timings = {} # phase: [calls, total seconds, max seconds]
+    self.stacks = Counter()
+    self.samples = 0
+    self._active = {} # thread id: phase, for the sampler
+    self._profiles = []
+
+  def phase(self, name):
+    """ A context manager around one run of a phase """
+    if not self.running:
+      return _off
+    return _Phase(self, name)
+
+  def start(self, mode='sample', path='./profile.txt', interval=0.005):
+    with self._lock:
+      if self.running:
+        return
+      self._reset()
+      self.mode, self.path, self.interval = mode, path, interval
+      self.started = time.monotonic()
+      self._stop = threading.Event()
+      if mode == 'sample':
+        threading.Thread(target=self._sample, args=(self._stop,), daemon=True).start()
+      self.running = True
+    log.info(f'Profiling started ({mode})')
+
+  def stop(self):
+    """ Stops profiling and writes the report. Returns its path, or None if we weren't running """
+    with self._lock:
+      if not self.running:
+        return None
+      self.running = False
+      self._stop.set()
+      report = self.report()
+    with open(self.path, 'w') as file:
+      file.write(report)
+    log.info(f'Profiling stopped, report written to {self.path}')
+    return self.path
+
+  def toggle(self, mode='sample', path='./profile.txt', interval=0.005):
+    if self.running:
+      return self.stop()
+    self.start(mode, path, interval)
+
+  def _enter(self, name):
+    local = self._local
+    depth = getattr(local, 'depth', 0)
+    local.depth = depth + 1
+    if depth > 0:
+      return
+    self._active[threading.get_ident()] = name
+    if self.mode == 'cprofile':
+      if getattr(local, 'profile', None) is None or local.generation is not self._profiles:
+        local.profile = cProfile.Profile()
+        local.generation = self._profiles
+        with self._lock:
+          self._profiles.append(local.profile)
+      try:
+        local.profile.enable()
+        local.enabled = True
+      except ValueError:
+        # Newer Pythons only allow one cProfile at a time across all threads
+        local.enabled = False
+
+  def _exit(self, name, seconds):
+    local = self._local
+    local.depth -= 1
+    with self._lock:
+      timing = self.timings.setdefault(name, [0, 0, 0])
+      timing[0] += 1
+      timing[1] += seconds
+      timing[2] = max(timing[2], seconds)
+    if local.depth > 0:
+      return
+    self._active.pop(threading.get_ident(), None)
+    if getattr(local, 'enabled', False):
+      local.profile.disable()
+      local.enabled = False
+
+  def _sample(self, stop):
+    while not stop.wait(self.interval):
+      frames = sys._current_frames()
+      for ident, name in list(self._active.items()):
+        frame = frames.get(ident)
+        if frame is None:
+          continue
+        stack = ';'.join(f'{x.name} ({x.filename}:{x.lineno})' for x in traceback.extract_stack(frame))
+        with self._lock:
+          self.stacks[(name, stack)] += 1
+          self.samples += 1
+
+  def report(self, top=20):
+    elapsed = time.monotonic() - self.started
+    out = io.StringIO()
+    out.write(f'Profiled for {elapsed:.1f}s in {self.mode} mode, {datetime.datetime.now():%Y-%m-%d %H:%M:%S}\n\n')
+
+    out.write(f'{"phase":<10} {"calls":>8} {"total s":>10} {"mean ms":>10} {"max ms":>10} {"% of time":>10}\n')
+    for name, (calls, total, longest) in sorted(self.timings.items(), key=lambda x: -x[1][1]):
+      out.write(f'{name:<10} {calls:>8} {total:>10.3f} {total / calls * 1000:>10.2f} {longest * 1000:>10.2f} {total / elapsed * 100 if elapsed > 0 else 0:>9.1f}%\n')
+
+    if self.mode == 'sample':
+      out.write(f'\nTop stacks ({self.samples} samples every {self.interval * 1000:g}ms, innermost call last)\n')
+      for (name, stack), count in self.stacks.most_common(top):
+        out.write(f'\n{count} samples ({count / max(self.samples, 1) * 100:.1f}%) in {name}:\n')
+        for call in stack.split(';'):
+          out.write(f'  {call}\n')
+    elif len(self._profiles) > 0:
+      out.write('\n')
+      stats = pstats.Stats(self._profiles[0], stream=out)
+      for profile in self._profiles[1:]:
+        stats.add(profile)
+      stats.sort_stats('cumulative').print_stats(top)
+
+    return out.getvalue()
+
+profiler = Profiler()
+
+def start_profiling(config):
+  profiler.start(config.profile_mode, config.profile_path, config.profile_interval)
+
+def toggle_profiling(config):
+  profiler.toggle(config.profile_mode, config.profile_path, config.profile_interval)
+
+def install_signal(get_config):
+  """ Toggles profiling on SIGUSR1, using whatever config `get_config` returns at the time. Only works from the main thread """
+  import signal
+  if not hasattr(signal, 'SIGUSR1') or threading.current_thread() is not threading.main_thread():
+    return False
+  # The report is written outside the handler, as it can take a moment
+  signal.signal(signal.SIGUSR1, lambda *_: threading.Thread(target=toggle_profiling, args=(get_config(),), daemon=True).start())
+  return True
@@ -0,0 +1,249 @@
+import glob, json, os, random, threading
+from collections import deque
+from .util import LoopWaiters, decode_json, encode_json
+
+def _intensity(item):
+  try:
+    return item[0]
+  except (TypeError, IndexError, KeyError):
+    return 0
+
+def _segment_numbers(path):
+  for name in glob.glob(glob.escape(path) + '.*'):
+    suffix = name[len(path) + 1:]
+    if suffix.isdigit():
+      yield int(suffix)
+
+class Spill:
+  """ Triggers that didn't fit in memory, oldest first, as JSON lines in
+      numbered segment files `<path>.<n>` of up to `segment_size` each.
+      Segments are read back whole and deleted once `release` is told
+      they've been checkpointed, so a crash never loses a trigger.
+  """
+
+  def __init__(self, path, start=0, segment_size=1000):
+    self.path = path
+    self.segment_size = segment_size
+    self.segments = deque() # [number, count] for each unread segment, oldest first
+    self.next = start
+
+    for number in sorted(self._numbers()):
+      if number < start:
+        os.remove(self._name(number))
+        continue
+      with open(self._name(number), 'r') as file:
+        count = sum(1 for line in file if line.strip() != '')
+      self.segments.append([number, count])
+      self.next = number + 1
+
+  def _name(self, number):
+    return f'{self.path}.{number}'
+
+  def _numbers(self):
+    return _segment_numbers(self.path)
+
+  @staticmethod
+  def remove(path):
+    """ Deletes every segment at path, e.g. when the checkpoint they belong to is reset """
+    for number in _segment_numbers(path):
+      os.remove(f'{path}.{number}')
+
+  def __len__(self):
+    return sum(count for _, count in self.segments)
+
+  @property
+  def start(self):
+    """ The oldest segment still needed """
+    return self.segments[0][0] if len(self.segments) > 0 else self.next
+
+  def append(self, item):
+    if len(self.segments) == 0 or self.segments[-1][1] >= self.segment_size:
+      self.segments.append([self.next, 0])
+      self.next += 1
+    segment = self.segments[-1]
+    with open(self._name(segment[0]), 'a') as file:
+      file.write(json.dumps(item, default=encode_json) + '\n')
+    segment[1] += 1
+
+  def _read(self, number):
+    with open(self._name(number), 'r') as file:
+      return [ json.loads(line, object_hook=decode_json) for line in file if line.strip() != '' ]
+
+  def pop_segment(self):
+    """ Returns the oldest segment's triggers. Its file stays until released """
+    number, _ = self.segments.popleft()
+    return self._read(number)
+
+  def __iter__(self):
+    for number, _ in list(self.segments):
+      yield from self._read(number)
+
+  def clear(self):
+    self.segments.clear()
+
+  def release(self, start):
+    """ Deletes the segment files before `start`, now they're safely checkpointed """
+    for number in self._numbers():
+      if number < min(start, self.start):
+        os.remove(self._name(number))
+
+class ActionQueue:
+  """ Thread-safe FIFO of parsed triggers waiting to be acted on.
+      The read thread appends, the act loop waits on `peek` and only
+      removes an item once it's been acted on successfully.
+
+      It's unbounded unless given limits. At most `memory_limit` triggers
+      are held in memory; past that, newer ones go to a `Spill` at
+      `spill_path` until the ones ahead of them have been acted on, or are
+      shed if there's no spill path. Past `limit` in total, a trigger is
+      shed to make room according to `shed`:
+      - 'oldest' drops the oldest waiting trigger
+      - 'lowest' drops the lowest intensity trigger held in memory (or the
+        new one, if that's lower)
+      - 'sample' drops one held in memory at random, so what's kept is
+        spread across the flood rather than all from the start or end
+      The trigger at the front may be being acted on, so it's never shed.
+      `on_shed` is called each time one is.
+  """
+
+  def __init__(self, items=(), memory_limit=None, limit=None, shed='oldest', spill_path=None, spill_start=0, on_shed=None):
+    self._items = deque(items)
+    self._cond = threading.Condition()
+    self._waiters = LoopWaiters()
+    self.spill = Spill(spill_path, spill_start, segment_size=memory_limit or 1000) if spill_path is not None else None
+    if self.spill is None and memory_limit is not None:
+      limit = memory_limit if limit is None else min(limit, memory_limit)
+    self.memory_limit = memory_limit
+    self.limit = limit
+    self.shed = shed
+    self.on_shed = on_shed
+    self._refill()
+
+  @classmethod
+  def from_config(cls, config, items=(), spill_start=0, on_shed=None):
+    return cls(items, memory_limit=config.queue_memory_limit, limit=config.queue_limit, shed=config.queue_shed,
+      spill_path=config.queue_spill_path, spill_start=spill_start, on_shed=on_shed)
+
+  def _len(self):
+    return len(self._items) + (len(self.spill) if self.spill is not None else 0)
+
+  def __len__(self):
+    with self._cond:
+      return self._len()
+
+  def __iter__(self):
+    """ Iterates over a snapshot of what's in memory, then reads whatever has been spilled """
+    with self._cond:
+      items = list(self._items)
+      spilled = list(self.spill.segments) if self.spill is not None else []
+    yield from items
+    for number, _ in spilled:
+      try:
+        yield from self.spill._read(number)
+      except FileNotFoundError:
+        return
+
+  def _refill(self):
+    # Spilled triggers come back a segment at a time once memory has run dry
+    if self.spill is not None and len(self._items) == 0 and len(self.spill) > 0:
+      self._items.extend(self.spill.pop_segment())
+
+  def _make_room(self, item):
+    """ Sheds a trigger if we're at the limit. Returns False if the new one should be dropped instead """
+    if self.limit is None or self._len() < self.limit:
+      return True
+
+    if self.on_shed is not None:
+      self.on_shed()
+
+    # Everything but the front is fair game; if that's all that's in memory, bring the next segment in
+    if len(self._items) < 2 and self.spill is not None and len(self.spill) > 0:
+      self._items.extend(self.spill.pop_segment())
+    if len(self._items) < 2:
+      return False
+
+    if self.shed == 'lowest':
+      index = min(range(1, len(self._items)), key=lambda i: _intensity(self._items[i]))
+      if _intensity(item) <= _intensity(self._items[index]):
+        return False
+    elif self.shed == 'sample':
+      index = random.randint(1, len(self._items) - 1)
+    else:
+      index = 1
+    del self._items[index]
+    return True
+
+  def _append(self, item):
+    if not self._make_room(item):
+      return
+    if self.spill is not None and (len(self.spill) > 0 or (self.memory_limit is not None and len(self._items) >= self.memory_limit)):
+      self.spill.append(item)
+    else:
+      self._items.append(item)
+
+  def _notify(self):
+    self._cond.notify_all()
+    self._waiters.wake()
+
+  def append(self, item):
+    with self._cond:
+      self._append(item)
+      self._notify()
+
+  def extend(self, items):
+    with self._cond:
+      for item in items:
+        self._append(item)
+      self._notify()
+
+  def peek(self, timeout=None):
+    """ Returns the next item without removing it, waiting up to `timeout`
+        seconds for one to arrive. Returns None if nothing turned up.
+    """
+    with self._cond:
+      if not self._cond.wait_for(lambda: len(self._items) > 0, timeout):
+        return None
+      return self._items[0]
+
+  async def peek_async(self, timeout=None):
+    """ peek for asyncio: waits on the running loop rather than blocking it """
+    if not await self._waiters.wait_for(self._cond, lambda: len(self._items) > 0, timeout):
+      return None
+    with self._cond:
+      return self._items[0] if len(self._items) > 0 else None
+
+  def popleft(self):
+    with self._cond:
+      item = self._items.popleft()
+      self._refill()
+      return item
+
+  def discard(self, count):
+    """ Removes up to count items from the front """
+    with self._cond:
+      for _ in range(count):
+        self._refill()
+        if len(self._items) == 0:
+          break
+        self._items.popleft()
+      self._refill()
+
+  def clear(self):
+    with self._cond:
+      self._items.clear()
+      if self.spill is not None:
+        self.spill.clear()
+
+  def snapshot(self):
+    """ (items in memory, extra checkpoint state). Spilled triggers are already on disk, so
+        only the number of the first segment still needed is saved
+    """
+    with self._cond:
+      extra = { 'spill_start': self.spill.start } if self.spill is not None else {}
+      return list(self._items), extra
+
+  def release(self, state):
+    """ Checkpoint on_write hook: deletes spill segments the checkpoint no longer needs """
+    if self.spill is not None and 'spill_start' in state:
+      with self._cond:
+        self.spill.release(state['spill_start'])
@@ -0,0 +1,65 @@
+import dataclasses, logging, os, threading
+from .config import Config
+
+log = logging.getLogger(__name__)
+
+# Fields that are only read at startup, so changing them needs a restart
+restart_fields = ['credsfilepath', 'lastfilepath', 'targetfilepath', 'ingest_mode', 'fetch_mode', 'act_workers', 'parse_workers', 'parse_pool', 'queue_memory_limit',
+  'queue_limit', 'queue_shed', 'queue_spill_path', 'metrics_port', 'config_reload_interval']
+
+class ConfigWatcher:
+  """ Checks a config file's modification time every `interval` seconds.
+      When it changes the file is loaded into a new Config, which validates
+      it, and the result is handed to `on_change`. A file that doesn't load,
+      or that `on_change` raises on, is logged and otherwise ignored so the
+      running config stays in place.
+  """
+
+  def __init__(self, path, on_change, interval=2):
+    self.path = path
+    self.on_change = on_change
+    self.interval = interval
+    self.mtime = self._mtime()
+    self._stop = threading.Event()
+
+  def _mtime(self):
+    try:
+      return os.stat(self.path).st_mtime_ns
+    except OSError:
+      return None
+
+  def start(self):
+    threading.Thread(target=self._run, daemon=True).start()
+    return self
+
+  def stop(self):
+    self._stop.set()
+
+  def _run(self):
+    while not self._stop.wait(self.interval):
+      self.check()
+
+  def check(self):
+    """ Reloads the config if the file has changed. Returns True if a new config was applied """
+    mtime = self._mtime()
+    if mtime is None or mtime == self.mtime:
+      return False
+    self.mtime = mtime
+
+    try:
+      config = Config.from_file(self.path)
+      self.on_change(config)
+    except Exception as e:
+      log.error(f'Not reloading {self.path}: {e}')
+      return False
+    log.info(f'Reloaded {self.path}')
+    return True
+
+def changed_fields(old, new):
+  """ Names of the fields that differ between two Configs """
+  return [ field.name for field in dataclasses.fields(Config) if getattr(old, field.name) != getattr(new, field.name) ]
+
+def warn_restart_fields(old, new):
+  for name in changed_fields(old, new):
+    if name in restart_fields:
+      log.warning(f'{name} has changed; this takes effect on restart')
@@ -0,0 +1,198 @@
+import collections, dataclasses, datetime, json, logging, os, tempfile, time
+from .thread import ThreadIndex
+from .queue import ActionQueue
+from .rules import RuleSet
+from .scheduler import PollInterval
+from .shaping import Shaper, sent_time
+from .store import TriggerStore
+
+log = logging.getLogger(__name__)
+
+def _encode(value):
+  if isinstance(value, datetime.datetime):
+    return value.isoformat()
+  return str(value)
+
+def dump_statuses(statuses, path):
+  """ Writes statuses (e.g. status_context's descendants) to path, one JSON object per line """
+  with open(path, 'w') as file:
+    for status in statuses:
+      file.write(json.dumps(status, default=_encode) + '\n')
+
+def load_statuses(path):
+  """ Reads statuses written by `dump_statuses`, or captured any other way as JSON lines.
+      Each status' created_at is turned back into a datetime.
+  """
+  statuses = []
+  with open(path, 'r') as file:
+    for line in file:
+      if line.strip() == '':
+        continue
+      status = json.loads(line)
+      if isinstance(status['created_at'], str):
+        status['created_at'] = datetime.datetime.fromisoformat(status['created_at'])
+      statuses.append(status)
+  return statuses
+
+def find_root(statuses):
+  """ Guesses the post a recorded thread hangs off: the parent most replied to from outside the thread """
+  ids = set(str(x['id']) for x in statuses)
+  parents = collections.Counter(x['in_reply_to_id'] for x in statuses if str(x['in_reply_to_id']) not in ids)
+  if len(parents) == 0:
+    raise ValueError('Unable to find the root of the recorded thread')
+  return parents.most_common(1)[0][0]
+
+class VirtualClock:
+  """ A clock for the shaper that only moves when told to """
+
+  def __init__(self, start):
+    self.time = start
+
+  def monotonic(self):
+    return self.time.timestamp()
+
+  def now(self, tz=None):
+    if tz is None:
+      return self.time.astimezone().replace(tzinfo=None)
+    return self.time.astimezone(tz)
+
+class Replay:
+  """ Feeds a recorded thread through the same parse, queue and act
+      pipeline as a live run, without Mastodon.
+
+      Time is virtual: the thread is polled every parse_interval (adapting
+      as usual) and acts are spaced by the shaper as usual, but the clock
+      jumps ahead rather than sleeping, so thousands of replies replay in
+      seconds. Pass `speed` to sleep for 1/speed of each jump instead, e.g.
+      speed=60 plays an hour in a minute.
+
+      Without an act function, acts are dry runs. Each trigger is logged,
+      and recorded in the trigger store if it looks like the built-in
+      parser's [intensity, user, sent] so that stats functions can be tried
+      out on it. The store and other files live in a scratch directory, so
+      a replay can't disturb a live campaign.
+  """
+
+  def __init__(self, statuses, parse_function, config, act_function=None, empty_function=None, root_id=None, speed=None):
+    self.statuses = sorted(statuses, key=lambda x: x['created_at'])
+    self.act_function = act_function if act_function is not None else self.dry_run
+    self.empty_function = empty_function
+    self.speed = speed
+
+    self.scratch = tempfile.TemporaryDirectory(prefix='bzz-replay-')
+    self.c = dataclasses.replace(config,
+      storefilepath=os.path.join(self.scratch.name, 'triggers.db'),
+      knownfilepath=os.path.join(self.scratch.name, 'known.txt'),
+      lastfilepath=os.path.join(self.scratch.name, 'last.txt'),
+      logfilepath=os.path.join(self.scratch.name, 'log.txt'))
+    self.parse_function = parse_function if parse_function is not None else RuleSet.from_config(self.c)
+
+    self.thread = ThreadIndex(root_id if root_id is not None else find_root(self.statuses))
+    self.root_id = self.thread.root_id
+    self.queue = ActionQueue()
+    self.acted = []
+    self.counts = { 'replies': 0, 'triggers': 0, 'acts': 0, 'dropped': 0, 'errors': 0 }
+
+  def dry_run(self, item, target_id, config):
+    log.debug(f'Would act on {item}')
+    sent = sent_time(item)
+    if sent is not None:
+      TriggerStore.open(config.storefilepath).record(target_id, item[0], item[1], sent=sent, acted=self.clock.now())
+
+  def stats(self, stats_function):
+    """ Runs a stats function over what the replay acted on """
+    return stats_function(self.root_id, self.c)
+
+  def close(self):
+    store = TriggerStore._open.pop(self.c.storefilepath, None)
+    if store is not None:
+      store.close()
+    self.scratch.cleanup()
+
+  def _advance(self, to):
+    if to <= self.clock.time:
+      return
+    if self.speed is not None:
+      time.sleep((to - self.clock.time).total_seconds() / self.speed)
+    self.clock.time = to
+
+  def _ingest(self, statuses):
+    subset = self.thread.merge(statuses, strict=self.c.strict)
+    self.counts['replies'] += len(subset)
+    for item in subset:
+      result = self.parse_function(item, self.c)
+      if result:
+        self.counts['triggers'] += 1
+        self.queue.append(result)
+    return len(subset)
+
+  def _act(self, shaper):
+    item, count, dropped = shaper.select(self.queue.peek(0), self.queue)
+    if dropped > 0:
+      self.counts['dropped'] += dropped
+      self.queue.discard(dropped)
+    if item is None:
+      return
+
+    shaper.spend()
+    try:
+      result = self.act_function(item, self.root_id, self.c)
+    except Exception as e:
+      log.error(f'Act failed: {e}')
+      self.counts['errors'] += 1
+      return
+    if result != False:
+      self.queue.discard(count)
+      self.counts['acts'] += 1
+      self.acted.append((self.clock.time, item))
+
+  def run(self):
+    """ Replays the whole thread and returns counts of replies, triggers, acts, dropped
+        triggers and act errors, plus the virtual time it took in `seconds`
+    """
+    if len(self.statuses) == 0:
+      return dict(self.counts, seconds=0)
+
+    start = self.statuses[0]['created_at']
+    self.clock = VirtualClock(start)
+    shaper = Shaper.from_config(self.c, clock=self.clock)
+    interval = PollInterval.from_config(self.c)
+    act_interval = datetime.timedelta(seconds=self.c.act_interval)
+    next_poll = next_empty = start
+    seen = 0
+
+    while seen < len(self.statuses) or len(self.queue) > 0:
+      now = self.clock.time
+
+      if seen < len(self.statuses) and now >= next_poll:
+        # A poll sees everything posted so far; the index ignores what it's already had
+        posted = seen
+        while posted < len(self.statuses) and self.statuses[posted]['created_at'] <= now:
+          posted += 1
+        new = self._ingest(self.statuses[seen:posted])
+        seen = posted
+        next_poll = now + datetime.timedelta(seconds=interval.update(new))
+        continue
+
+      if len(self.queue) > 0:
+        wait = shaper.wait()
+        if wait <= 0:
+          self._act(shaper)
+          continue
+        # At least a tick, or rounding could leave us short of the token forever
+        until = now + max(datetime.timedelta(seconds=wait), datetime.timedelta(microseconds=1))
+        self._advance(min(until, next_poll) if seen < len(self.statuses) else until)
+        continue
+
+      # Like the act loop, offer the empty function the idle queue every act_interval
+      if self.empty_function is None:
+        self._advance(next_poll)
+        continue
+      if now >= next_empty:
+        next_empty = now + act_interval
+        if self.empty_function(self.queue) == True:
+          shaper.allow_now()
+          continue
+      self._advance(min(next_poll, next_empty))
+
+    return dict(self.counts, seconds=(self.clock.time - start).total_seconds())
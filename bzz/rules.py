@@ -0,0 +1,69 @@
+import html, logging, re
+
+log = logging.getLogger(__name__)
+
+_tags = re.compile(r'<[^>]+>')
+
+def strip_html(content):
+  """ Turns a status' HTML content into plain text """
+  return html.unescape(_tags.sub(' ', content))
+
+class Rule:
+  """ A precompiled trigger pattern. The intensity of a match is its length
+      less `offset`, times `per_char`, capped at `max_intensity`. The
+      defaults turn 'bzzz' into 30.
+  """
+
+  def __init__(self, pattern, per_char=10, offset=1, max_intensity=100):
+    self.pattern = re.compile(pattern)
+    self.per_char = per_char
+    self.offset = offset
+    self.max_intensity = max_intensity
+
+  def intensity(self, text):
+    """ Returns the intensity for the first match in text, or None if there isn't one """
+    match = self.pattern.search(text)
+    if match is None:
+      return None
+    return min((len(match.group(0)) - self.offset) * self.per_char, self.max_intensity)
+
+class RuleSet:
+  """ A parse function built from config: the first rule to match a reply
+      decides its intensity, then the allow and deny lists decide whether
+      it's pushed as [intensity, source account, created datetime].
+  """
+
+  default_rules = [{ 'pattern': '[bB][z]{1,10}' }]
+
+  def __init__(self, rules, allow_list=None, deny_list=None):
+    self.rules = [ rule if isinstance(rule, Rule) else Rule(**rule) for rule in rules ]
+    self.allow = frozenset(x.casefold() for x in allow_list) if allow_list is not None else None
+    self.deny = frozenset(x.casefold() for x in deny_list) if deny_list is not None else frozenset()
+
+  @classmethod
+  def from_config(cls, config):
+    return cls(config.rules or cls.default_rules, allow_list=config.allow_list, deny_list=config.deny_list)
+
+  def intensity(self, item):
+    text = strip_html(item['content'])
+    for rule in self.rules:
+      intensity = rule.intensity(text)
+      if intensity is not None:
+        return intensity
+    return None
+
+  def __call__(self, item, config):
+    intensity = self.intensity(item)
+    if intensity is None:
+      return False
+
+    acct = item['account']['acct']
+    folded = acct.casefold()
+    if folded in self.deny:
+      log.info(f'Skipping {intensity} from {acct}, sent {item["created_at"].isoformat()} [denylist]')
+    elif self.allow is not None and folded not in self.allow:
+      log.info(f'Skipping {intensity} from {acct}, sent {item["created_at"].isoformat()} [allowlist]')
+    else:
+      log.info(f'Pushing {intensity} from {acct}, sent {item["created_at"].isoformat()}')
+      return [intensity, acct, item['created_at']]
+    return False
@@ -0,0 +1,162 @@
+import asyncio, logging, threading, time
+from .metrics import metrics
+from .profiling import profiler
+
+log = logging.getLogger(__name__)
+
+def ratelimit_spacing(m, reserve=10):
+  """ Seconds to leave between calls so the client's remaining budget lasts until the limit resets """
+  remaining = getattr(m, 'ratelimit_remaining', None)
+  reset = getattr(m, 'ratelimit_reset', None)
+  if remaining is None or reset is None:
+    return 0
+  window = max(reset - time.time(), 0)
+  return window / max(remaining - reserve, 1)
+
+class PollInterval:
+  """ The time to wait between polls of one post. It starts at `start`,
+      halves (down to `floor`) after each poll that finds new replies and
+      grows by `backoff` times (up to `ceiling`) after each that doesn't.
+  """
+
+  def __init__(self, start, floor, ceiling, backoff=1.5):
+    self.floor = floor
+    self.ceiling = max(floor, ceiling)
+    self.backoff = backoff
+    self.current = min(max(start, self.floor), self.ceiling)
+
+  @classmethod
+  def from_config(cls, config):
+    return cls(config.parse_interval, config.poll_min_interval, config.poll_max_interval, config.poll_backoff)
+
+  def update(self, new):
+    """ Adjusts the interval after a poll that found `new` replies, and returns it """
+    if new > 0:
+      self.current = max(self.current / 2, self.floor)
+    else:
+      self.current = min(self.current * self.backoff, self.ceiling)
+    return self.current
+
+class PollScheduler:
+  """ Shares one Mastodon client's request budget between any number of
+      targets. Each target is polled no more often than its own interval,
+      and calls are spaced out so that together they stay inside the
+      instance's rate limit, keeping `reserve` requests back for posting.
+  """
+
+  def __init__(self, m, targets=(), reserve=10):
+    self.m = m
+    self.targets = list(targets)
+    self.reserve = reserve
+    self.next_due = { target.target_id: 0 for target in self.targets }
+    self._cond = threading.Condition()
+
+  def add(self, target):
+    with self._cond:
+      self.targets.append(target)
+      self.next_due[target.target_id] = 0
+      self._cond.notify_all()
+
+  def poll_all(self):
+    """ Makes every target due now, e.g. after the stream reconnects """
+    with self._cond:
+      for target_id in self.next_due:
+        self.next_due[target_id] = 0
+      self._cond.notify_all()
+
+  def dispatch_status(self, status):
+    """ Hands a streamed status to every target; each decides if it's theirs """
+    for target in list(self.targets):
+      try:
+        target.stream_status(status)
+      except Exception as e:
+        log.error(f'Unable to ingest streamed status for {target.target_id}: {e}')
+
+  def spacing(self):
+    return ratelimit_spacing(self.m, self.reserve)
+
+  def _next(self):
+    """ Waits for the target that's due soonest and returns it """
+    with self._cond:
+      while True:
+        if len(self.targets) > 0:
+          target = min(self.targets, key=lambda x: self.next_due[x.target_id])
+          wait = self.next_due[target.target_id] - time.monotonic()
+          if wait <= 0:
+            return target
+        else:
+          wait = None
+        self._cond.wait(wait)
+
+  def poll(self, target):
+    """ Fetches and ingests a target's new replies, then adjusts its interval """
+    started = time.perf_counter()
+    try:
+      responses = self._fetch(target)
+    except Exception as e:
+      return self._failed(target, e, 'fetch')
+    self._fetched(target, responses, started)
+
+    # A parse that raises only fails this target's poll; the replies are tried again next time
+    try:
+      new = target.ingest(responses)
+    except Exception as e:
+      return self._failed(target, e, 'ingest')
+    self._ingested(target, new)
+
+  async def poll_async(self, target):
+    """ poll for asyncio. Only the client's calls go to a worker thread """
+    started = time.perf_counter()
+    try:
+      responses = await asyncio.to_thread(self._fetch, target)
+    except Exception as e:
+      return self._failed(target, e, 'fetch')
+    self._fetched(target, responses, started)
+
+    try:
+      new = await target.ingest_async(responses)
+    except Exception as e:
+      return self._failed(target, e, 'ingest')
+    self._ingested(target, new)
+
+  def _fetch(self, target):
+    log.debug(f'Fetching responses for {target.target_id}. Last seen is {target.last_action_id}')
+    with profiler.phase('fetch'):
+      return target.fetcher.fetch(self.m)
+
+  def _fetched(self, target, responses, started):
+    metrics.poll_seconds.observe(time.perf_counter() - started, target=target.target_id)
+    metrics.poll_replies.observe(len(responses), target=target.target_id)
+
+  def _failed(self, target, e, stage):
+    metrics.poll_errors.inc(target=target.target_id)
+    if stage == 'fetch':
+      log.warning(f'Unable to fetch responses for {target.target_id}: {e}')
+    else:
+      log.error(f'Unable to ingest responses for {target.target_id}: {e}')
+    target.interval.update(0)
+
+  def _ingested(self, target, new):
+    target.interval.update(new)
+
+    # Only now that they're queued can the fetcher move past them
+    target.fetcher.commit()
+    target.checkpoint.touch()
+
+  def run(self):
+    while True:
+      target = self._next()
+
+      # Reschedule before polling so a poll_all that lands mid-poll isn't lost
+      started = time.monotonic()
+      with self._cond:
+        self.next_due[target.target_id] = started + target.poll_interval
+
+      self.poll(target)
+
+      # The poll may have changed the target's interval
+      with self._cond:
+        if self.next_due[target.target_id] != 0:
+          self.next_due[target.target_id] = started + target.poll_interval
+
+      time.sleep(self.spacing())
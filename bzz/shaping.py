@@ -0,0 +1,135 @@
+import datetime, time
+
+def _intensity(item):
+  return item[0]
+
+def sent_time(item):
+  """ The created datetime of a parsed [intensity, user, created] trigger,
+      or None for anything else (e.g. a reset queued by an empty function)
+  """
+  try:
+    sent = item[2]
+  except (TypeError, IndexError, KeyError):
+    return None
+  return sent if isinstance(sent, datetime.datetime) else None
+
+class Clock:
+  """ Real time, as seen by the shaper. Replays swap in a virtual one """
+
+  def monotonic(self):
+    return time.monotonic()
+
+  def now(self, tz=None):
+    return datetime.datetime.now(tz)
+
+class Shaper:
+  """ Decides when the act loop may act and on what.
+
+      - A token bucket refilling at one token per `interval` seconds with
+        room for `burst` tokens. With a burst of 1 this is just a minimum
+        spacing between attempts.
+      - `max_age` drops triggers from the front of the queue that were
+        sent more than that many seconds ago.
+      - `coalesce` merges the triggers at the front of the queue into one,
+        taking the 'max', 'sum' or 'latest' intensity. Only triggers sent
+        within `window` seconds of the oldest are merged; with no window,
+        everything queued is.
+
+      Triggers are expected to look like [intensity, user, created], as the
+      built-in parser produces; anything else is acted on as-is.
+  """
+
+  def __init__(self, interval, burst=1, max_age=None, coalesce=None, window=None, max_intensity=100, clock=None):
+    self.clock = clock if clock is not None else Clock()
+    self.interval = interval
+    self.burst = max(burst, 1)
+    self.max_age = max_age
+    self.coalesce = coalesce
+    self.window = window
+    self.max_intensity = max_intensity
+    self.tokens = self.burst
+    self.updated = self.clock.monotonic()
+
+  @classmethod
+  def from_config(cls, config, clock=None):
+    return cls(config.act_interval, burst=config.act_burst, max_age=config.act_max_age,
+      coalesce=config.act_coalesce, window=config.act_coalesce_window, clock=clock)
+
+  def _refill(self):
+    now = self.clock.monotonic()
+    if self.interval > 0:
+      self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+    else:
+      self.tokens = self.burst
+    self.updated = now
+
+  def wait(self):
+    """ Seconds until the next attempt is allowed """
+    self._refill()
+    if self.tokens >= 1:
+      return 0
+    return (1 - self.tokens) * self.interval
+
+  def spend(self):
+    self._refill()
+    self.tokens -= 1
+
+  def allow_now(self):
+    """ Lets the next attempt go straight away """
+    self._refill()
+    self.tokens = max(self.tokens, 1)
+
+  def select(self, head, queue):
+    """ Given the item at the front of the queue, returns (item to act on, number of
+        queued items it stands for, number of stale items to drop from the front).
+        The item is None if everything was stale.
+    """
+    if self.max_age is None and self.coalesce is None:
+      return head, 1, 0
+
+    # Read the queue lazily; it may have spilled to disk, and we usually only need the front
+    items = iter(queue)
+    dropped = 0
+    head = None
+    for item in items:
+      sent = sent_time(item)
+      if self.max_age is None or sent is None or (self.clock.now(sent.tzinfo) - sent).total_seconds() <= self.max_age:
+        head = item
+        break
+      dropped += 1
+
+    if head is None:
+      return None, 0, dropped
+
+    first_sent = sent_time(head)
+    if self.coalesce is None or first_sent is None:
+      return head, 1, dropped
+
+    group = [head]
+    for item in items:
+      sent = sent_time(item)
+      if sent is None or (self.window is not None and (sent - first_sent).total_seconds() > self.window):
+        break
+      group.append(item)
+
+    return self._merge(group), len(group), dropped
+
+  def _merge(self, group):
+    if len(group) == 1:
+      return group[0]
+
+    latest = max(group, key=sent_time)
+    if self.coalesce == 'latest':
+      chosen = latest
+      intensity = _intensity(latest)
+    elif self.coalesce == 'sum':
+      chosen = max(group, key=_intensity)
+      intensity = min(sum(_intensity(x) for x in group), self.max_intensity)
+    else:
+      chosen = max(group, key=_intensity)
+      intensity = _intensity(chosen)
+
+    merged = list(chosen)
+    merged[0] = intensity
+    merged[2] = sent_time(latest)
+    return merged
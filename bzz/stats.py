@@ -0,0 +1,220 @@
+import datetime, hashlib, heapq, random
+
+def format_userlist(names, sep=', ', last_sep=' and '):
+  """ 'a, b, c and d' """
+  output = sep.join(names)
+  if sep in output:
+    output = last_sep.join(output.rsplit(sep, 1))
+  return output
+
+class DistinctSample:
+  """ A uniform random sample of up to `size` distinct names from a stream
+      that may repeat them, in constant memory: each name gets a random but
+      fixed rank (a salted hash), and the `size` lowest ranked are kept.
+      This is reservoir sampling made to ignore repeats. One extra is kept so
+      `more` knows whether there were names left out.
+  """
+
+  def __init__(self, size, seed=None):
+    self.size = size
+    self.salt = str(seed if seed is not None else random.getrandbits(64)).encode()
+    self._heap = [] # (-rank, name), so the highest kept rank is on top
+    self._names = set()
+
+  def _rank(self, name):
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8, key=self.salt).digest(), 'big')
+
+  def add(self, name):
+    if name in self._names:
+      return
+    rank = self._rank(name)
+    if len(self._heap) <= self.size:
+      heapq.heappush(self._heap, (-rank, name))
+      self._names.add(name)
+    elif rank < -self._heap[0][0]:
+      _, dropped = heapq.heapreplace(self._heap, (-rank, name))
+      self._names.discard(dropped)
+      self._names.add(name)
+
+  def clear(self):
+    self._heap.clear()
+    self._names.clear()
+
+  @property
+  def more(self):
+    """ True if there were more than `size` distinct names """
+    return len(self._heap) > self.size
+
+  def sample(self, n=None):
+    """ Up to n (default `size`) of the names. Any n of them are as random as the rest """
+    return [ name for _, name in sorted(self._heap, reverse=True)[:self.size][:n] ]
+
+  def estimate(self):
+    """ The number of distinct names seen: exact up to `size`, estimated from the ranks past that """
+    if not self.more:
+      return len(self._heap)
+    return round(self.size / ((-self._heap[0][0] + 1) / 2 ** 64))
+
+class TopSenders:
+  """ The heaviest senders in a stream, tracking at most `capacity` names
+      (the Space-Saving algorithm). Anyone who sent more than 1/capacity
+      of all triggers is guaranteed to be kept. Counts can be over by at
+      most the smallest count kept.
+  """
+
+  def __init__(self, capacity=100):
+    self.capacity = capacity
+    self.counts = {}
+
+  def add(self, name, count=1):
+    if name in self.counts or len(self.counts) < self.capacity:
+      self.counts[name] = self.counts.get(name, 0) + count
+      return
+    smallest = min(self.counts, key=self.counts.get)
+    self.counts[name] = self.counts.pop(smallest) + count
+
+  def top(self, n=3):
+    return heapq.nlargest(n, self.counts.items(), key=lambda x: x[1])
+
+class StreamingStats:
+  """ Statistics over a post's triggers, built in one pass in constant
+      memory so closing a post with a huge history doesn't load it all:
+      - count, total, mean and the exact max intensity
+      - how many triggers hit the max, and a sample of who sent them.
+        Holders of earlier, lower maxima are forgotten when it rises
+      - exact percentiles (intensities are counted by value, and there
+        are only so many values)
+      - the top senders, a sample of everyone who sent anything and an
+        estimate of how many did
+      - if `is_new` is given, a sample of the senders it says are new. It's
+        called for every trigger (or every sender, from a store), so should
+        be quick
+
+      Feed it triggers with `add`, or build it from a TriggerStore's per-post
+      totals with `from_store`.
+  """
+
+  def __init__(self, sample_size=3, top_size=3, percentiles=(50, 90, 99), is_new=None, seed=None):
+    self.sample_size = sample_size
+    self.top_size = top_size
+    self.percentiles = percentiles
+    self.is_new = is_new
+    self.count = 0
+    self.total = 0
+    self.max_intensity = None
+    self.max_count = 0
+    self.max_holders = DistinctSample(sample_size, seed)
+    self.intensities = {}
+    self.senders = TopSenders(max(top_size * 10, 100))
+    self.users = DistinctSample(max(sample_size, 256), seed) # Bigger than needed for the sample, to estimate how many there were
+    self.new_users = DistinctSample(sample_size, seed)
+    self.user_count = None # Exact, when built from a store
+
+  @classmethod
+  def from_store(cls, store, post_id, chunk_size=1000, **kwargs):
+    """ Builds stats from a TriggerStore's per-post totals, paging through its senders and max holders rather than
+        reading every trigger back. Percentiles are counted from the store's index; pass percentiles=() to skip them
+    """
+    stats = cls(**kwargs)
+    totals = store.stats(post_id)
+    if totals['count'] == 0:
+      return stats
+    stats.count = totals['count']
+    stats.total = totals['total']
+    stats.max_intensity = totals['max_intensity']
+    stats.user_count = totals['users']
+
+    for user, count in store.max_holders(post_id, chunk_size):
+      stats.max_count += count
+      stats.max_holders.add(user)
+    for user, count in store.users(post_id, chunk_size):
+      stats._add_sender(user, count)
+    if len(stats.percentiles) > 0:
+      stats.intensities = store.intensities(post_id)
+    return stats
+
+  def add(self, intensity, user):
+    self.count += 1
+    self.total += intensity
+    self.intensities[intensity] = self.intensities.get(intensity, 0) + 1
+
+    if self.max_intensity is None or intensity > self.max_intensity:
+      self.max_intensity = intensity
+      self.max_count = 0
+      self.max_holders.clear()
+    if intensity == self.max_intensity:
+      self.max_count += 1
+      self.max_holders.add(user)
+
+    self._add_sender(user)
+
+  def _add_sender(self, user, count=1):
+    self.senders.add(user, count)
+    self.users.add(user)
+    if self.is_new is not None and self.is_new(user):
+      self.new_users.add(user)
+
+  @property
+  def mean(self):
+    return self.total / self.count if self.count > 0 else 0
+
+  def percentile(self, p):
+    """ The smallest intensity that at least p% of triggers were at or below """
+    if self.count == 0:
+      return None
+    needed = p / 100 * self.count
+    running = 0
+    for intensity in sorted(self.intensities):
+      running += self.intensities[intensity]
+      if running >= needed:
+        return intensity
+    return self.max_intensity
+
+  def result(self):
+    return {
+      'count': self.count,
+      'total': self.total,
+      'mean': self.mean,
+      'max_intensity': self.max_intensity or 0,
+      'max_count': self.max_count,
+      'max_holders': self.max_holders.sample(),
+      'more_max_holders': self.max_holders.more,
+      'percentiles': { p: self.percentile(p) for p in self.percentiles },
+      'top_senders': self.senders.top(self.top_size),
+      'users': self.user_count if self.user_count is not None else self.users.estimate(),
+      'user_sample': self.users.sample(self.sample_size),
+      'new_users': self.new_users.sample(),
+      'more_new_users': self.new_users.more,
+    }
+
+def _mentions(names, more, rest='others'):
+  names = [ f'@{x}' for x in names ]
+  if more:
+    names.append(rest)
+  return format_userlist(names)
+
+def post_stats(post_id, config):
+  """ A stats function for close_post: summarises the post's triggers from the trigger store and
+      greets its new visitors from the known file
+  """
+  from .store import TriggerStore
+  from .visitors import VisitorRegistry
+
+  # act registers visitors as it goes; this also catches anyone recorded before it did
+  visitors = VisitorRegistry.open(config.knownfilepath)
+  stats = StreamingStats.from_store(TriggerStore.from_config(config), post_id, percentiles=(),
+    is_new=lambda user: visitors.add(user, post_id) or visitors.first_seen.get(user) == post_id).result()
+
+  if stats['count'] == 0:
+    return '\n\nNo triggers received! :('
+
+  new_count = len(visitors.new_on(post_id))
+  new_users = _mentions(stats['new_users'], stats['more_new_users'], 'the rest')
+  return f"""
+
+Closed at {datetime.datetime.strftime(datetime.datetime.now(), '%H:%M, %b %d')}
+
+- Max intensity was {stats['max_intensity']} (from {_mentions(stats['max_holders'], stats['more_max_holders'])})
+- Average intensity was ~{int(stats['mean'])} across {stats['count']} triggers
+- {new_count if new_count > 0 else "No"} new visitors this time!{f" (Hi {new_users}!)" if len(new_users) > 0 else " :("}
+"""
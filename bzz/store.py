@@ -0,0 +1,206 @@
+import datetime, logging, os, sqlite3, threading
+
+log = logging.getLogger(__name__)
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS triggers (
+  id INTEGER PRIMARY KEY,
+  post_id INTEGER NOT NULL,
+  sent TEXT,
+  acted TEXT,
+  intensity INTEGER NOT NULL,
+  user TEXT NOT NULL
+);
+DROP INDEX IF EXISTS triggers_post;
+CREATE INDEX IF NOT EXISTS triggers_post_intensity ON triggers (post_id, intensity, user);
+CREATE INDEX IF NOT EXISTS triggers_post_id ON triggers (post_id, id);
+
+CREATE TABLE IF NOT EXISTS post_stats (
+  post_id INTEGER PRIMARY KEY,
+  count INTEGER NOT NULL,
+  total INTEGER NOT NULL,
+  max_intensity INTEGER NOT NULL,
+  users INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS post_users (
+  post_id INTEGER NOT NULL,
+  user TEXT NOT NULL,
+  count INTEGER NOT NULL,
+  PRIMARY KEY (post_id, user)
+);
+
+CREATE TABLE IF NOT EXISTS imported_logs (
+  path TEXT PRIMARY KEY
+);
+'''
+
+class TriggerStore:
+  """ SQLite-backed log of every trigger acted on. Per-post aggregates are
+      kept up to date as triggers are recorded, so reading them back when
+      a post closes doesn't touch the rest of the history.
+  """
+
+  _open = {}
+  _open_lock = threading.Lock()
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(path, check_same_thread=False)
+    self._db.row_factory = sqlite3.Row
+    self._db.executescript(_schema)
+    self._imported = set() # Logs already checked by this process, so from_config is cheap to call per trigger
+
+  @classmethod
+  def open(cls, path):
+    """ Returns the shared store for path, opening it the first time """
+    with cls._open_lock:
+      if path not in cls._open:
+        cls._open[path] = cls(path)
+      return cls._open[path]
+
+  @classmethod
+  def from_config(cls, config):
+    """ Opens the store at storefilepath, bringing in the old CSV log at logfilepath the first time """
+    store = cls.open(config.storefilepath)
+    store.import_log(config.logfilepath)
+    return store
+
+  def close(self):
+    with self._lock:
+      self._db.close()
+
+  def _insert(self, post_id, intensity, user, sent, acted):
+    """ Adds one trigger and folds it into the post's aggregates. Call with the lock held, in a transaction """
+    self._db.execute(
+      'INSERT INTO triggers (post_id, sent, acted, intensity, user) VALUES (?, ?, ?, ?, ?)',
+      (post_id, sent, acted, intensity, user)
+    )
+    new_user = self._db.execute(
+      'INSERT OR IGNORE INTO post_users (post_id, user, count) VALUES (?, ?, 0)', (post_id, user)
+    ).rowcount
+    self._db.execute('UPDATE post_users SET count = count + 1 WHERE post_id = ? AND user = ?', (post_id, user))
+    self._db.execute(
+      '''INSERT INTO post_stats (post_id, count, total, max_intensity, users) VALUES (?, 1, ?, ?, ?)
+         ON CONFLICT (post_id) DO UPDATE SET
+           count = count + 1,
+           total = total + excluded.total,
+           max_intensity = max(max_intensity, excluded.max_intensity),
+           users = users + excluded.users''',
+      (post_id, intensity, intensity, new_user)
+    )
+
+  def record(self, post_id, intensity, user, sent=None, acted=None):
+    """ Logs a trigger and folds it into the post's aggregates """
+    acted = acted if acted is not None else datetime.datetime.now()
+    with self._lock, self._db:
+      self._insert(post_id, intensity, user, sent.isoformat() if sent is not None else None, acted.isoformat())
+
+  def import_log(self, path):
+    """ Brings in the triggers from a CSV log written by older versions
+        (post_id,sent,acted,intensity,user per line), once per log. Returns
+        how many were imported.
+    """
+    key = os.path.abspath(path)
+    if key in self._imported:
+      return 0
+    with self._lock, self._db:
+      self._imported.add(key)
+      if self._db.execute('SELECT 1 FROM imported_logs WHERE path = ?', (key,)).fetchone() is not None:
+        return 0
+      self._db.execute('INSERT INTO imported_logs (path) VALUES (?)', (key,))
+      try:
+        file = open(path, 'r')
+      except FileNotFoundError:
+        return 0
+
+      count = 0
+      with file:
+        for line in file:
+          try:
+            post_id, sent, acted, intensity, user = line.rstrip('\n').split(',', 4)
+            self._insert(int(post_id), int(intensity), user, sent or None, acted)
+          except ValueError:
+            log.warning(f'Skipping unreadable line in {path}: {line.strip()}')
+            continue
+          count += 1
+    if count > 0:
+      log.info(f'Imported {count} triggers from {path}')
+    return count
+
+  def stats(self, post_id):
+    """ Returns a dict of count, total, max_intensity, mean and users (distinct)
+        for post_id. Everything is zero if there have been no triggers.
+    """
+    with self._lock:
+      row = self._db.execute('SELECT * FROM post_stats WHERE post_id = ?', (post_id,)).fetchone()
+    if row is None:
+      return { 'count': 0, 'total': 0, 'max_intensity': 0, 'mean': 0, 'users': 0 }
+    return {
+      'count': row['count'],
+      'total': row['total'],
+      'max_intensity': row['max_intensity'],
+      'mean': row['total'] / row['count'],
+      'users': row['users'],
+    }
+
+  def max_holders(self, post_id, chunk_size=1000):
+    """ Yields (user, count) for each user who sent the post's highest intensity, with how many times they did,
+        `chunk_size` at a time
+    """
+    top = self.stats(post_id)['max_intensity']
+    last_user = ''
+    while True:
+      with self._lock:
+        rows = self._db.execute(
+          '''SELECT user, COUNT(*) AS count FROM triggers WHERE post_id = ? AND intensity = ? AND user > ?
+             GROUP BY user ORDER BY user LIMIT ?''',
+          (post_id, top, last_user, chunk_size)
+        ).fetchall()
+      for row in rows:
+        yield row['user'], row['count']
+      if len(rows) < chunk_size:
+        return
+      last_user = rows[-1]['user']
+
+  def users(self, post_id, chunk_size=1000):
+    """ Yields (user, trigger count) for everyone who triggered post_id, `chunk_size` at a time """
+    last_user = ''
+    while True:
+      with self._lock:
+        rows = self._db.execute(
+          'SELECT user, count FROM post_users WHERE post_id = ? AND user > ? ORDER BY user LIMIT ?',
+          (post_id, last_user, chunk_size)
+        ).fetchall()
+      for row in rows:
+        yield row['user'], row['count']
+      if len(rows) < chunk_size:
+        return
+      last_user = rows[-1]['user']
+
+  def intensities(self, post_id):
+    """ Returns {intensity: count} for post_id. Read from the index, so it doesn't load the triggers themselves """
+    with self._lock:
+      rows = self._db.execute(
+        'SELECT intensity, COUNT(*) AS count FROM triggers WHERE post_id = ? GROUP BY intensity', (post_id,)
+      ).fetchall()
+    return { row['intensity']: row['count'] for row in rows }
+
+  def triggers(self, post_id, chunk_size=1000):
+    """ Yields (sent, acted, intensity, user) for each of post_id's triggers, oldest first.
+        They're read `chunk_size` at a time, so a long history isn't all loaded at once
+        and triggers can still be recorded while it's being read.
+    """
+    last_id = 0
+    while True:
+      with self._lock:
+        rows = self._db.execute(
+          'SELECT id, sent, acted, intensity, user FROM triggers WHERE post_id = ? AND id > ? ORDER BY id LIMIT ?',
+          (post_id, last_id, chunk_size)
+        ).fetchall()
+      for row in rows:
+        yield tuple(row)[1:]
+      if len(rows) < chunk_size:
+        return
+      last_id = rows[-1]['id']
@@ -0,0 +1,51 @@
+from mastodon import StreamListener
+
+class ReplyListener(StreamListener):
+  """ Listens to the user stream and hands any status that might be a reply
+      to `on_status`. Replies to our post usually arrive as mention
+      notifications, but replies from accounts we follow also show up as
+      updates, so both are forwarded and the harness dedupes them.
+
+      `on_gap` is called once the stream is back after a drop, on the first
+      event or heartbeat of the new connection, so the harness can poll for
+      anything posted while it was reconnecting. Calling it when the
+      connection drops would poll before the gap had happened.
+  """
+
+  def __init__(self, on_status, on_gap=None):
+    self.on_status = on_status
+    self.on_gap = on_gap
+    self.connected = False
+    self.gap = False
+
+  def handle_stream(self, response):
+    # Called once per connection, so any connection after the first is a reconnect
+    if self.connected:
+      self.gap = True
+    self.connected = True
+    super().handle_stream(response)
+
+  def _fill_gap(self):
+    if self.gap:
+      self.gap = False
+      if self.on_gap is not None:
+        self.on_gap()
+
+  def on_any_event(self, name, data=None, for_stream=None):
+    self._fill_gap()
+
+  def handle_heartbeat(self):
+    self._fill_gap()
+
+  def on_update(self, status):
+    self.on_status(status)
+
+  def on_notification(self, notification):
+    if notification['type'] == 'mention' and notification.get('status') is not None:
+      self.on_status(notification['status'])
+
+  def on_abort(self, err):
+    self.gap = True
+
+  def on_unknown_event(self, name, unknown_event=None):
+    self._fill_gap()
@@ -0,0 +1,318 @@
+import asyncio, datetime, inspect, logging, threading, time
+from .thread import ThreadIndex
+from .queue import ActionQueue
+from .checkpoint import Checkpoint
+from .rules import RuleSet
+from .shaping import Shaper, sent_time
+from .dispatch import ActDispatcher
+from .parsing import ParseStage
+from .scheduler import PollInterval
+from .fetch import make_fetcher
+from .metrics import metrics
+from .profiling import profiler
+from .util import call
+
+log = logging.getLogger(__name__)
+
+class Target:
+  """ A single watched post: its thread index, pending triggers and
+      checkpoint, plus the functions that turn its replies into actions.
+      Fetching is left to whoever owns the client; replies are handed in
+      through `ingest` and `stream_status`.
+
+      The `_async` methods are the same steps for asyncio: they await
+      coroutine parse, act and empty functions on the running loop, and run
+      plain ones on worker threads.
+  """
+
+  def __init__(self, target_id, parse_function, act_function, config, empty_function=None, device_function=None):
+    self.target_id = target_id
+    self.parse_function = parse_function if parse_function is not None else RuleSet.from_config(config)
+    self.act_function = act_function
+    self.empty_function = empty_function
+    self.c = config
+
+    # With a worker pool, triggers for the same device (as named by device_function) stay in order
+    self.device_function = device_function if device_function is not None else (lambda item: self.target_id)
+
+    # Pick up where we left off, including anything that was queued but not yet acted on
+    self.ingest_lock = threading.Lock()
+    self._async_ingest_lock = None
+    self.checkpoint = Checkpoint(self.c.lastfilepath, self.snapshot, self.c.checkpoint_interval)
+    self.last_action_id, pending = self.checkpoint.load()
+    self.queue = ActionQueue.from_config(self.c, pending, spill_start=self.checkpoint.state.get('spill_start', 0),
+      on_shed=lambda: metrics.shed.inc(target=self.target_id))
+    self.checkpoint.on_write = self.queue.release
+    self.dispatcher = ActDispatcher.from_config(self.c, on_done=self.checkpoint.touch) if self.c.act_workers > 0 else None
+    metrics.track_queue(self.queue, target=self.target_id)
+    if len(pending) > 0:
+      log.info(f'Restored {len(pending)} pending triggers for {self.target_id}')
+
+    # Replies can reach us from both the poller and the stream, so track what we've handled
+    self.thread = ThreadIndex(self.target_id, self.last_action_id)
+    self.fetcher = make_fetcher(self.c, self.target_id, self.thread, self.checkpoint.state)
+    self.interval = PollInterval.from_config(self.c)
+    self.parse_stage = ParseStage.from_config(self.c)
+
+  @property
+  def poll_interval(self):
+    if self.c.ingest_mode == 'stream':
+      return self.c.stream_fallback_interval
+    return self.interval.current
+
+  def stream_status(self, status):
+    """ Ingests a status from the stream if it belongs under our post """
+    if not self.thread.contains(status.get('in_reply_to_id')):
+      return
+    self.ingest([status])
+
+  async def stream_status_async(self, status):
+    if not self.thread.contains(status.get('in_reply_to_id')):
+      return
+    await self.ingest_async([status])
+
+  def reconfigure(self, config):
+    """ Swaps in a new config between batches. The built-in parser is rebuilt from its rules first, so
+        a bad pattern raises here and leaves the old config running
+    """
+    parse_function = RuleSet.from_config(config) if isinstance(self.parse_function, RuleSet) else self.parse_function
+    with self.ingest_lock:
+      self.parse_function = parse_function
+      self.interval = PollInterval(self.interval.current, config.poll_min_interval, config.poll_max_interval, config.poll_backoff)
+      self.checkpoint.interval = config.checkpoint_interval
+      if self.dispatcher is not None:
+        self.dispatcher.reconfigure(config)
+      self.c = config
+
+  def ingest(self, responses):
+    """ Parses and queues any replies we haven't handled yet, oldest first. Returns how many there were """
+    with self.ingest_lock:
+      config = self.c
+      subset = self._unseen(responses, config)
+      if len(subset) == 0:
+        return 0
+
+      # Everything is parsed before anything is queued, indexed or the cursor moves, so if
+      # a parse raises, none of the batch is handled and it's all tried again next poll
+      results = self.parse_stage.map(self.parse_function, subset, config)
+      self._queue_results(responses, subset, results)
+
+    # Outside the lock, as the checkpoint takes it to snapshot
+    self.checkpoint.touch()
+    return len(subset)
+
+  async def ingest_async(self, responses):
+    """ ingest for asyncio. The thread lock is only held between awaits; an asyncio lock keeps batches whole """
+    if self._async_ingest_lock is None:
+      self._async_ingest_lock = asyncio.Lock()
+    async with self._async_ingest_lock:
+      with self.ingest_lock:
+        config = self.c
+        subset = self._unseen(responses, config)
+        parse_function = self.parse_function
+      if len(subset) == 0:
+        return 0
+
+      results = await self.parse_stage.map_async(parse_function, subset, config)
+      with self.ingest_lock:
+        self._queue_results(responses, subset, results)
+
+    self.checkpoint.touch()
+    return len(subset)
+
+  def _unseen(self, responses, config):
+    subset = self.thread.unseen(responses, strict=config.strict)
+    if len(subset) == 0:
+      self.thread.add(responses)
+      log.debug('Nothing to process.')
+    else:
+      metrics.new_replies.inc(len(subset), target=self.target_id)
+    return subset
+
+  def _queue_results(self, responses, subset, results):
+    self.thread.add(responses)
+
+    for item, (result, seconds) in zip(subset, results):
+      metrics.parse_seconds.observe(seconds, target=self.target_id)
+      if result:
+        metrics.triggers.inc(target=self.target_id)
+        self.queue.append(result)
+
+      self.last_action_id = self.thread.advance(item['id'])
+
+    log.debug(f'Last seen is now {self.last_action_id}')
+
+  def snapshot(self):
+    """ The cursor and pending queue as of now, for the checkpoint """
+    with self.ingest_lock:
+      in_flight = self.dispatcher.pending() if self.dispatcher is not None else []
+      queued, extra = self.queue.snapshot()
+      return self.last_action_id, in_flight + queued, { **extra, **self.fetcher.state() }
+
+  def act(self, item):
+    """ Calls the act function, recording how long it took and how long the trigger waited """
+    started = time.perf_counter()
+    try:
+      with profiler.phase('act'):
+        result = self.act_function(item, self.target_id, self.c)
+    except Exception:
+      metrics.act_errors.inc(target=self.target_id)
+      raise
+    return self._acted(item, result, started)
+
+  async def act_async(self, item):
+    if not inspect.iscoroutinefunction(self.act_function):
+      return await asyncio.to_thread(self.act, item)
+    started = time.perf_counter()
+    try:
+      with profiler.phase('act'):
+        result = await self.act_function(item, self.target_id, self.c)
+    except Exception:
+      metrics.act_errors.inc(target=self.target_id)
+      raise
+    return self._acted(item, result, started)
+
+  def _act_threadsafe(self, item, loop):
+    # For act workers under asyncio: the worker thread waits while the act function runs on the loop
+    return asyncio.run_coroutine_threadsafe(self.act_async(item), loop).result()
+
+  def _acted(self, item, result, started):
+    metrics.act_seconds.observe(time.perf_counter() - started, target=self.target_id)
+
+    if result != False:
+      metrics.acts.inc(target=self.target_id)
+      sent = sent_time(item)
+      if sent is not None:
+        metrics.act_latency.observe((datetime.datetime.now(sent.tzinfo) - sent).total_seconds(), target=self.target_id)
+    return result
+
+  def act_loop(self):
+    """ Acts on queued triggers forever, flushing the checkpoint on the way out """
+    try:
+      self._act_loop()
+    finally:
+      self.checkpoint.flush()
+
+  async def act_loop_async(self):
+    """ act_loop for asyncio, waiting on the running loop """
+    loop = asyncio.get_running_loop()
+    config = self.c
+    shaper = Shaper.from_config(config)
+    try:
+      while True:
+        if self.c is not config:
+          config = self.c
+          shaper = Shaper.from_config(config)
+
+        head = await self.queue.peek_async(timeout=config.act_interval)
+
+        if head is None:
+          log.debug('Nothing to send')
+
+          if self.empty_function is not None:
+            with profiler.phase('empty'):
+              result = await call(self.empty_function, self.queue)
+            if result == True:
+              shaper.allow_now()
+          continue
+
+        if self.dispatcher is not None and not await self.dispatcher.wait_idle_async(self.device_function(head), config.act_interval):
+          continue
+
+        wait = shaper.wait()
+        if wait > 0:
+          await asyncio.sleep(wait)
+
+        item, count = self._select(shaper, head)
+        if item is None:
+          continue
+
+        if self.dispatcher is not None:
+          key = self.device_function(item)
+          if not self.dispatcher.idle(key):
+            continue
+          shaper.spend()
+          if inspect.iscoroutinefunction(self.act_function):
+            self.dispatcher.submit(key, self._act_threadsafe, item, loop)
+          else:
+            self.dispatcher.submit(key, self.act, item)
+          self.queue.discard(count)
+          continue
+
+        shaper.spend()
+        try:
+          result = await self.act_async(item)
+          if result != False:
+            self.queue.discard(count)
+            self.checkpoint.touch()
+        except Exception as e:
+          log.error(f'Act failed: {e}')
+    finally:
+      self.checkpoint.flush()
+
+  def _select(self, shaper, head):
+    """ The item to act on next and how many queued triggers it covers, once stale ones are dropped """
+    item, count, dropped = shaper.select(head, self.queue)
+    if dropped > 0:
+      log.warning(f'Dropping {dropped} stale triggers')
+      metrics.dropped.inc(dropped, target=self.target_id)
+      self.queue.discard(dropped)
+      self.checkpoint.touch()
+    return item, count
+
+  def _act_loop(self):
+    # The shaper spaces attempts out by act_interval (allowing for bursts) rather than
+    # sleeping a fixed amount, so an idle loop acts on a new trigger as soon as it's queued
+    config = self.c
+    shaper = Shaper.from_config(config)
+    while True:
+      # Pick up a reloaded config between cycles
+      if self.c is not config:
+        config = self.c
+        shaper = Shaper.from_config(config)
+
+      head = self.queue.peek(timeout=config.act_interval)
+
+      if head is None:
+        log.debug('Nothing to send')
+
+        if self.empty_function is not None:
+          with profiler.phase('empty'):
+            result = self.empty_function(self.queue) # Manipulate the queue in some way...
+          if result == True:
+            shaper.allow_now()
+            continue # ...and immediately process it we returned True.
+        continue
+
+      # With workers, a trigger stays queued (where the bounds, max age and coalescing apply) until its device is free
+      if self.dispatcher is not None and not self.dispatcher.wait_idle(self.device_function(head), config.act_interval):
+        continue
+
+      wait = shaper.wait()
+      if wait > 0:
+        time.sleep(wait)
+
+      # Anything that arrived while we waited is fair game for coalescing
+      item, count = self._select(shaper, head)
+      if item is None:
+        continue
+
+      if self.dispatcher is not None:
+        # Coalescing may have made it another device's trigger, and that one may be busy
+        key = self.device_function(item)
+        if not self.dispatcher.idle(key):
+          continue
+        # The dispatcher owns retries from here on
+        shaper.spend()
+        self.dispatcher.submit(key, self.act, item)
+        self.queue.discard(count)
+        continue
+
+      shaper.spend()
+      try:
+        result = self.act(item)
+        if result != False:
+          self.queue.discard(count)
+          self.checkpoint.touch()
+      except Exception as e:
+        log.error(f'Act failed: {e}')
@@ -0,0 +1,78 @@
+def _id(status_id):
+  """ Newer Mastodon.py versions hand ids back as strings, but they're ordered as numbers """
+  if status_id is None:
+    return None
+  try:
+    return int(status_id)
+  except ValueError:
+    return status_id
+
+class ThreadIndex:
+  """ In-memory index of the replies under a post, keyed by status id.
+      Every status we've been handed is remembered along with its parent,
+      so merging a fresh fetch only costs a lookup per status and only the
+      unseen ones get sorted and returned.
+
+      `floor` is the cursor we resumed from: Mastodon ids are time-ordered,
+      so anything at or below it was handled by a previous run. This doesn't
+      need the cursor status to still be in the thread, so a deleted reply
+      can't make us lose our place.
+  """
+
+  def __init__(self, root_id, cursor=None):
+    self.root_id = _id(root_id)
+    self.parents = {}
+    self.floor = _id(cursor)
+    self.cursor = _id(cursor)
+
+  def __len__(self):
+    return len(self.parents)
+
+  def contains(self, status_id):
+    status_id = _id(status_id)
+    return status_id == self.root_id or status_id in self.parents
+
+  def unseen(self, statuses, strict=False):
+    """ Returns the statuses we haven't seen before, oldest first, without
+        indexing them. In strict mode only direct replies to the root are
+        returned. Call `add` once they've been handled.
+    """
+    new = []
+    batch = set()
+    for status in statuses:
+      status_id = _id(status['id'])
+      if status_id in self.parents or status_id in batch:
+        continue
+      batch.add(status_id)
+
+      if self.floor is not None and status_id <= self.floor:
+        continue
+      if strict and _id(status['in_reply_to_id']) != self.root_id:
+        continue
+      new.append(status)
+
+    new.sort(key=lambda x: x['created_at'])
+    return new
+
+  def add(self, statuses):
+    """ Indexes statuses, so they count as seen and as part of the thread """
+    for status in statuses:
+      status_id = _id(status['id'])
+      if status_id not in self.parents:
+        self.parents[status_id] = _id(status['in_reply_to_id'])
+
+  def merge(self, statuses, strict=False):
+    """ Indexes statuses and returns the ones we hadn't seen before, oldest
+        first. In strict mode only direct replies to the root are returned,
+        though everything is still indexed.
+    """
+    new = self.unseen(statuses, strict)
+    self.add(statuses)
+    return new
+
+  def advance(self, status_id):
+    """ Moves the cursor forward to status_id if it's newer """
+    status_id = _id(status_id)
+    if self.cursor is None or status_id > self.cursor:
+      self.cursor = status_id
+    return self.cursor
@@ -1,5 +1,73 @@
-def find_index(predicate, l):
-  for i,e in enumerate(l):
-    if predicate(e): return i
-  return None
-  
\ No newline at end of file
+import asyncio, datetime, inspect, os
+
+def write_atomic(path, text):
+  """ Writes text to path so that a crash leaves either the old or the new
+      contents, never a truncated file.
+  """
+  tmp_path = f'{path}.tmp'
+  with open(tmp_path, 'w') as file:
+    file.write(text)
+    file.flush()
+    os.fsync(file.fileno())
+  os.replace(tmp_path, path)
+
+def encode_json(value):
+  """ json.dumps default for trigger items, which may hold datetimes """
+  if isinstance(value, datetime.datetime):
+    return { '__datetime__': value.isoformat() }
+  raise TypeError(f'{type(value).__name__} is not serializable')
+
+def decode_json(value):
+  """ json.loads object_hook undoing encode_json """
+  if '__datetime__' in value:
+    return datetime.datetime.fromisoformat(value['__datetime__'])
+  return value
+
+async def call(function, *args):
+  """ Awaits a coroutine function directly, or runs a plain function in the
+      default executor so it can't block the loop.
+  """
+  if inspect.iscoroutinefunction(function):
+    return await function(*args)
+  result = await asyncio.to_thread(function, *args)
+  if inspect.isawaitable(result):
+    result = await result
+  return result
+
+class LoopWaiters:
+  """ Lets coroutines wait on state guarded by a threading.Condition without
+      blocking their event loop. Whoever notifies the condition calls `wake`
+      too, from any thread.
+  """
+
+  def __init__(self):
+    self._waiters = set()
+
+  def wake(self):
+    for loop, event in list(self._waiters):
+      loop.call_soon_threadsafe(event.set)
+
+  async def wait_for(self, cond, predicate, timeout=None):
+    """ Awaitable cond.wait_for(predicate, timeout). Returns the predicate's last value """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+    while True:
+      event = asyncio.Event()
+      with cond:
+        result = predicate()
+        if result:
+          return result
+        # Registered under the lock, so a wake can't land between the check and the wait
+        waiter = (loop, event)
+        self._waiters.add(waiter)
+      try:
+        remaining = deadline - loop.time() if deadline is not None else None
+        if remaining is not None and remaining <= 0:
+          return result
+        try:
+          await asyncio.wait_for(event.wait(), remaining)
+        except asyncio.TimeoutError:
+          with cond:
+            return predicate()
+      finally:
+        self._waiters.discard(waiter)
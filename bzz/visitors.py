@@ -0,0 +1,97 @@
+import threading
+from .util import write_atomic
+
+class VisitorRegistry:
+  """ Everyone who has ever triggered a post, and the post they first
+      showed up on. New visitors are appended to `path` as `name,post_id`
+      lines as soon as they're added, so it's safe to update from `act`.
+      Bare `name` lines from older known files are read as visitors from
+      before anyone was tracking posts.
+
+      The file is compacted (rewritten atomically without duplicates or
+      torn lines) on load if needed, and after every `compact_every`
+      appends.
+  """
+
+  _open = {}
+  _open_lock = threading.Lock()
+
+  def __init__(self, path, compact_every=1000):
+    self.path = path
+    self.compact_every = compact_every
+    self._lock = threading.Lock()
+    self.first_seen = {}
+    self.by_post = {}
+    self._appended = 0
+
+    if self._load():
+      self.compact()
+
+  @classmethod
+  def open(cls, path):
+    """ Returns the shared registry for path, loading it the first time """
+    with cls._open_lock:
+      if path not in cls._open:
+        cls._open[path] = cls(path)
+      return cls._open[path]
+
+  def _load(self):
+    """ Reads the file, returning True if it needs compacting """
+    try:
+      with open(self.path, 'r') as file:
+        text = file.read()
+    except FileNotFoundError:
+      return False
+
+    dirty = text != '' and not text.endswith('\n')
+    for line in text.splitlines():
+      name, _, post_id = line.strip().partition(',')
+      if name == '' or name in self.first_seen:
+        dirty = True
+        continue
+      try:
+        self._remember(name, int(post_id) if post_id != '' else None)
+      except ValueError:
+        dirty = True
+    return dirty
+
+  def _remember(self, name, post_id):
+    self.first_seen[name] = post_id
+    self.by_post.setdefault(post_id, set()).add(name)
+
+  def __contains__(self, name):
+    return name in self.first_seen
+
+  def __len__(self):
+    return len(self.first_seen)
+
+  def add(self, name, post_id):
+    """ Registers name as a visitor to post_id. Returns True if they're new """
+    with self._lock:
+      if name in self.first_seen:
+        return False
+      self._remember(name, post_id)
+      with open(self.path, 'a') as file:
+        file.write(f'{name},{post_id}\n')
+      self._appended += 1
+      compact = self._appended >= self.compact_every
+
+    if compact:
+      self.compact()
+    return True
+
+  def new_on(self, post_id):
+    """ The visitors whose first trigger was on post_id """
+    with self._lock:
+      return set(self.by_post.get(post_id, ()))
+
+  def new_since(self, post_id):
+    """ The visitors whose first trigger was on post_id or a later post """
+    with self._lock:
+      return set().union(*[ names for post, names in self.by_post.items() if post is not None and post >= post_id ])
+
+  def compact(self):
+    with self._lock:
+      lines = [ f'{name}\n' if post_id is None else f'{name},{post_id}\n' for name, post_id in self.first_seen.items() ]
+      write_atomic(self.path, ''.join(lines))
+      self._appended = 0
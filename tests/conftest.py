@@ -0,0 +1,12 @@
+import os, sys, time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'bench'))
+
+def wait_for(condition, timeout=5):
+  """ Polls condition until it's true, failing after timeout seconds """
+  deadline = time.monotonic() + timeout
+  while not condition():
+    assert time.monotonic() < deadline, 'timed out'
+    time.sleep(0.01)
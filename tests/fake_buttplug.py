@@ -0,0 +1,110 @@
+""" A stand-in Intiface/Buttplug server (message version 3) for testing
+    ButtplugClient. It answers the handshake with `devices`, replies Ok to
+    commands (or Error for a device it doesn't have), and records every
+    message it gets. Replies can be held back with `hold` and sent in any
+    order with `release`, devices added and removed while connected, and
+    every connection cut off with `drop` to test reconnecting.
+"""
+
+import json, threading
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.server import serve
+
+class FakeButtplug:
+  def __init__(self, devices=(0,), max_ping=0):
+    self.devices = { index: { 'DeviceIndex': index, 'DeviceName': f'Device {index}' } for index in devices }
+    self.max_ping = max_ping
+    self.received = [] # (message type, body) for everything the clients sent
+    self.connections = []
+    self.connected = 0
+    self.holding = False
+    self.held = []
+    self.lock = threading.Lock()
+    self.server = serve(self.handle, '127.0.0.1', 0)
+
+  @property
+  def url(self):
+    return f'ws://127.0.0.1:{self.server.socket.getsockname()[1]}'
+
+  def start(self):
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    return self
+
+  def shutdown(self):
+    self.server.shutdown()
+
+  def count(self, message_type):
+    with self.lock:
+      return sum(1 for x, _ in self.received if x == message_type)
+
+  def reply(self, message_type, body):
+    """ The server's answer to one message """
+    message_id = body['Id']
+    if message_type == 'RequestServerInfo':
+      return { 'ServerInfo': { 'Id': message_id, 'ServerName': 'Fake', 'MessageVersion': 3, 'MaxPingTime': self.max_ping } }
+    if message_type == 'RequestDeviceList':
+      return { 'DeviceList': { 'Id': message_id, 'Devices': list(self.devices.values()) } }
+    if 'DeviceIndex' in body and body['DeviceIndex'] not in self.devices:
+      return { 'Error': { 'Id': message_id, 'ErrorMessage': f'No device {body["DeviceIndex"]}', 'ErrorCode': 3 } }
+    return { 'Ok': { 'Id': message_id } }
+
+  def handle(self, ws):
+    with self.lock:
+      self.connections.append(ws)
+      self.connected += 1
+    try:
+      for text in ws:
+        for entry in json.loads(text):
+          for message_type, body in entry.items():
+            reply = self.reply(message_type, body)
+            with self.lock:
+              self.received.append((message_type, body))
+              # The handshake is never held, so the client always gets connected
+              if self.holding and message_type not in ('RequestServerInfo', 'RequestDeviceList'):
+                self.held.append((ws, reply))
+                continue
+            ws.send(json.dumps([reply]))
+    except ConnectionClosed:
+      pass
+    finally:
+      with self.lock:
+        self.connections.remove(ws)
+
+  def _send(self, ws, message):
+    # A client may have gone since, which is fine
+    try:
+      ws.send(json.dumps([message]))
+    except ConnectionClosed:
+      pass
+
+  def hold(self):
+    """ Keeps replies to commands back until `release` """
+    self.holding = True
+
+  def release(self, reverse=False):
+    with self.lock:
+      self.holding = False
+      held, self.held = self.held, []
+    for ws, reply in reversed(held) if reverse else held:
+      self._send(ws, reply)
+
+  def broadcast(self, message):
+    with self.lock:
+      connections = list(self.connections)
+    for ws in connections:
+      self._send(ws, message)
+
+  def add_device(self, index):
+    self.devices[index] = { 'DeviceIndex': index, 'DeviceName': f'Device {index}' }
+    self.broadcast({ 'DeviceAdded': { 'Id': 0, **self.devices[index] } })
+
+  def remove_device(self, index):
+    del self.devices[index]
+    self.broadcast({ 'DeviceRemoved': { 'Id': 0, 'DeviceIndex': index } })
+
+  def drop(self):
+    """ Cuts off every client """
+    with self.lock:
+      connections = list(self.connections)
+    for ws in connections:
+      ws.close()
@@ -0,0 +1,46 @@
+import asyncio, datetime, threading
+from bzz.config import Config
+from bzz.target import Target
+
+def reply(status_id):
+  return { 'id': status_id, 'in_reply_to_id': 1, 'created_at': datetime.datetime.now(datetime.timezone.utc) }
+
+def test_coroutines_parse_and_act_on_the_loop_while_plain_ones_stay_off_it(tmp_path):
+  where = { 'parse': set(), 'act': set(), 'sync': set() }
+
+  async def parse(item, config):
+    where['parse'].add(threading.current_thread())
+    await asyncio.sleep(0)
+    return [item['id'], 'user', item['created_at']]
+
+  async def act(item, target_id, config):
+    where['act'].add(threading.current_thread())
+    await asyncio.sleep(0)
+
+  def sync_parse(item, config):
+    where['sync'].add(threading.current_thread())
+    return None
+
+  async def main():
+    config = Config(lastfilepath=str(tmp_path / 'last.txt'), act_interval=0.01, parse_workers=2)
+    target = Target(1, parse, act, config)
+    acting = asyncio.create_task(target.act_loop_async())
+    try:
+      # The act loop is waiting on an empty queue, and mustn't hold up the loop while it does
+      assert await target.ingest_async([reply(3), reply(2)]) == 2
+      assert await target.ingest_async([reply(2)]) == 0
+      for _ in range(100):
+        if len(target.queue) == 0 and len(where['act']) > 0:
+          break
+        await asyncio.sleep(0.01)
+      assert len(target.queue) == 0
+      assert target.last_action_id == 3
+
+      target.parse_function = sync_parse
+      assert await target.ingest_async([reply(4)]) == 1
+    finally:
+      acting.cancel()
+
+  asyncio.run(main())
+  assert where['parse'] == where['act'] == { threading.current_thread() }
+  assert threading.current_thread() not in where['sync']
@@ -0,0 +1,78 @@
+import pytest
+
+pytest.importorskip('websockets')
+
+from fake_buttplug import FakeButtplug
+from bzz.buttplug import ButtplugClient, ButtplugError
+from conftest import wait_for
+
+@pytest.fixture
+def server():
+  server = FakeButtplug().start()
+  yield server
+  server.shutdown()
+
+def connect(server):
+  client = ButtplugClient(server.url, backoff=0.1).start()
+  assert client.wait_ready(5)
+  return client
+
+def test_handshake_lists_devices_and_tracks_changes(server):
+  client = connect(server)
+  try:
+    assert client.server_info['ServerName'] == 'Fake'
+    assert set(client.devices) == { 0 }
+    assert client.default_device() == 0
+
+    server.add_device(1)
+    wait_for(lambda: 1 in client.devices)
+    server.remove_device(0)
+    wait_for(lambda: 0 not in client.devices)
+    assert client.default_device() == 1
+  finally:
+    client.close()
+
+def test_replies_are_matched_to_commands_by_id(server):
+  client = connect(server)
+  try:
+    server.hold()
+    first = client.scalar(0, 0.5)
+    second = client.stop(0)
+    missing = client.scalar(9, 1)
+    wait_for(lambda: len(server.held) == 3)
+    server.release(reverse=True)
+
+    sent = [ body['Id'] for message_type, body in server.received if message_type in ('ScalarCmd', 'StopDeviceCmd') ]
+    assert first.result(5) == ('Ok', { 'Id': sent[0] })
+    assert second.result(5) == ('Ok', { 'Id': sent[1] })
+    with pytest.raises(ButtplugError):
+      missing.result(5)
+  finally:
+    client.close()
+
+def test_reconnects_and_fails_commands_in_flight(server):
+  client = connect(server)
+  try:
+    server.hold()
+    lost = client.scalar(0, 0.5)
+    wait_for(lambda: len(server.held) == 1)
+
+    server.drop()
+    with pytest.raises(ConnectionError):
+      lost.result(5)
+
+    server.release()
+    wait_for(lambda: server.connected == 2)
+    assert client.wait_ready(5)
+    assert client.scalar(0, 0.5).result(5)[0] == 'Ok'
+  finally:
+    client.close()
+
+def test_pings_inside_the_servers_max_ping_time():
+  server = FakeButtplug(max_ping=200).start()
+  client = connect(server)
+  try:
+    wait_for(lambda: server.count('Ping') >= 3, timeout=2)
+  finally:
+    client.close()
+    server.shutdown()
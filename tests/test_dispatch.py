@@ -0,0 +1,28 @@
+import datetime, threading, time
+from bzz.config import Config
+from bzz.metrics import metrics
+from bzz.target import Target
+
+def test_triggers_wait_in_the_bounded_queue_while_the_output_is_busy(tmp_path):
+  acted = []
+  def act(item, target_id, config):
+    acted.append((datetime.datetime.now(datetime.timezone.utc) - item[2]).total_seconds())
+    time.sleep(0.2)
+
+  config = Config(lastfilepath=str(tmp_path / 'last.txt'), act_workers=1, act_interval=0.01, queue_limit=3, act_max_age=1)
+  target = Target(901, lambda item, config: None, act, config)
+  threading.Thread(target=target._act_loop, daemon=True).start()
+
+  # Replies arrive ten times faster than the output can take them
+  most_in_flight = 0
+  for i in range(40):
+    target.queue.append([i, 'user', datetime.datetime.now(datetime.timezone.utc)])
+    most_in_flight = max(most_in_flight, len(target.dispatcher.pending()))
+    time.sleep(0.02)
+  time.sleep(0.5)
+
+  assert most_in_flight <= 1
+  assert metrics.shed.value(target=901) > 0
+  assert len(acted) < 15
+  # Nothing older than act_max_age was sent on
+  assert max(acted) < 1
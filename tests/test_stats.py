@@ -0,0 +1,26 @@
+import random
+from bzz.stats import StreamingStats
+from bzz.store import TriggerStore
+
+def test_stats_from_store_match_a_pass_over_the_triggers(tmp_path):
+  store = TriggerStore(str(tmp_path / 'triggers.db'))
+  rng = random.Random(0)
+  for _ in range(3000):
+    store.record(1, rng.choice([10, 20, 30, 40, 50]), f'user{rng.randrange(50)}')
+  store.record(2, 100, 'elsewhere')
+
+  streamed = StreamingStats(seed=0)
+  for _, _, intensity, user in store.triggers(1):
+    streamed.add(intensity, user)
+  # Small chunks, so paging through users and max holders is exercised
+  totals = StreamingStats.from_store(store, 1, chunk_size=7, seed=0)
+
+  expected, result = streamed.result(), totals.result()
+  for key in ['count', 'total', 'mean', 'max_intensity', 'max_count', 'max_holders', 'more_max_holders', 'percentiles', 'user_sample']:
+    assert result[key] == expected[key], key
+  assert result['users'] == 50
+  # Ties between senders can come out in either order
+  counts = dict(store.users(1))
+  assert [ count for _, count in result['top_senders'] ] == [ count for _, count in expected['top_senders'] ]
+  assert all(counts[user] == count for user, count in result['top_senders'])
+  assert 'elsewhere' not in counts
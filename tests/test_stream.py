@@ -0,0 +1,35 @@
+import threading
+from mastodon import Mastodon
+import fake_mastodon
+from bzz.stream import ReplyListener
+from conftest import wait_for
+
+def start_server(heartbeat=0.2):
+  thread = fake_mastodon.Thread(0)
+  server = fake_mastodon.make_server(thread, heartbeat=heartbeat)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return thread, server
+
+def test_stream_delivers_replies_and_polls_after_reconnecting():
+  thread, server = start_server()
+  m = Mastodon(access_token='token', api_base_url=f'http://127.0.0.1:{server.server_address[1]}')
+  seen, gaps = [], []
+  listener = ReplyListener(lambda status: seen.append(int(status['id'])), on_gap=lambda: gaps.append(len(thread.streams)))
+  handle = m.stream_user(listener, run_async=True, reconnect_async=True, reconnect_async_wait_sec=0.5)
+  try:
+    wait_for(lambda: len(thread.streams) == 1)
+    first = thread.add()
+    wait_for(lambda: first in seen)
+    assert gaps == []
+
+    # The gap poll waits for the new connection, so nothing posted while reconnecting is missed
+    thread.drop_streams()
+    wait_for(lambda: len(gaps) > 0)
+    assert gaps == [1]
+
+    second = thread.add()
+    wait_for(lambda: second in seen)
+    assert gaps == [1]
+  finally:
+    handle.close()
+    server.shutdown()